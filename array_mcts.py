@@ -0,0 +1,327 @@
+""" monte carlo tree search with the tree kept in numpy arrays """
+
+import math
+import numpy as np
+from random import choice
+import generic_mcts
+
+
+class McTreeArrays:
+    """ Struct-of-arrays node storage, grown by doubling
+
+    Children of a node occupy one contiguous block starting at
+    first_child. Moves are interned, so each node only keeps a move id.
+    """
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.playout_count = np.zeros(capacity, dtype=np.int32)
+        self.win_count = np.zeros(capacity, dtype=np.float64)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.child_count = np.zeros(capacity, dtype=np.int32)
+        self.move_id = np.full(capacity, -1, dtype=np.int32)
+        self.moves = []
+        self.move_ids = {}
+        self.game_states = []
+
+    def capacity(self):
+        return len(self.playout_count)
+
+    def reserve(self, n):
+        capacity = self.capacity()
+        if self.size + n <= capacity:
+            return
+        while self.size + n > capacity:
+            capacity *= 2
+        for name, fill in (('playout_count', 0), ('win_count', 0),
+                           ('parent', -1), ('first_child', -1),
+                           ('child_count', 0), ('move_id', -1)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def intern_move(self, move):
+        if move is None:
+            return -1
+        move_id = self.move_ids.get(move)
+        if move_id is None:
+            move_id = len(self.moves)
+            self.move_ids[move] = move_id
+            self.moves.append(move)
+        return move_id
+
+    def add_root(self, game_state, move=None):
+        self.reserve(1)
+        i = self.size
+        self.size += 1
+        self.move_id[i] = self.intern_move(move)
+        self.game_states.append(game_state)
+        return i
+
+    def add_children(self, parent, moves, game_states):
+        n = len(moves)
+        self.reserve(n)
+        first = self.size
+        self.size += n
+        self.parent[first:first + n] = parent
+        self.move_id[first:first + n] = [self.intern_move(m) for m in moves]
+        self.first_child[parent] = first
+        self.child_count[parent] = n
+        self.game_states.extend(game_states)
+        return first
+
+    def children(self, i):
+        first = self.first_child[i]
+        return range(first, first + self.child_count[i])
+
+    def move(self, i):
+        move_id = self.move_id[i]
+        return None if move_id < 0 else self.moves[move_id]
+
+    def subtree(self, root):
+        """ Copy of the subtree under root, renumbered so root is node 0 """
+        tree = McTreeArrays(max(1024, self.capacity()))
+        old_ids = [root]
+        tree.add_root(self.game_states[root], self.move(root))
+        j = 0
+        while j < len(old_ids):
+            old = old_ids[j]
+            tree.playout_count[j] = self.playout_count[old]
+            tree.win_count[j] = self.win_count[old]
+            children = self.children(old)
+            if len(children):
+                tree.add_children(
+                    j,
+                    [self.move(c) for c in children],
+                    [self.game_states[c] for c in children],
+                )
+                old_ids.extend(children)
+            j += 1
+        return tree
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (
+            self.playout_count, self.win_count, self.parent,
+            self.first_child, self.child_count, self.move_id))
+
+
+class ArrayNode:
+    """ McTreeNode-like view of one node, for playout policies and players """
+
+    __slots__ = ('tree', 'index')
+
+    # array trees do not run MCTS-Solver
+    proven = None
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def game_state(self):
+        return self.tree.game_states[self.index]
+
+    @property
+    def move(self):
+        return self.tree.move(self.index)
+
+    @property
+    def playout_count(self):
+        return int(self.tree.playout_count[self.index])
+
+    @property
+    def win_count(self):
+        return float(self.tree.win_count[self.index])
+
+    @win_count.setter
+    def win_count(self, value):
+        self.tree.win_count[self.index] = value
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.index]
+        return None if parent < 0 else ArrayNode(self.tree, parent)
+
+    @property
+    def children(self):
+        return [ArrayNode(self.tree, c) for c in self.tree.children(self.index)]
+
+    def get_weight(self):
+        if self.playout_count == 0:
+            return 0
+        return self.win_count / self.playout_count
+
+
+def uct_select_index(tree, path=None):
+    """ UctSelectPolicy.select over McTreeArrays, one child at a time """
+    i = 0
+    if path is not None:
+        path.append(i)
+    while tree.child_count[i]:
+        first = int(tree.first_child[i])
+        end = first + int(tree.child_count[i])
+        explore = 2 * math.log(tree.playout_count[i]) if tree.playout_count[i] else 0.0
+        playouts = tree.playout_count[first:end].tolist()
+        wins = tree.win_count[first:end].tolist()
+        best, best_value = -1, None
+        for c, (w, n) in enumerate(zip(wins, playouts)):
+            if n == 0:
+                value = 10000
+            else:
+                value = w / n + math.sqrt(explore / n)
+            if best_value is None or value > best_value:
+                best, best_value = c, value
+        i = first + best
+        if path is not None:
+            path.append(i)
+    return i
+
+
+class VectorUctSelectPolicy(generic_mcts.UctSelectPolicy):
+    """ UCT computed for a whole block of siblings in one numpy expression
+
+    Only select_index, over the contiguous blocks of an ArrayMcTree, is
+    vectorized. McTreeNode trees keep the inherited scalar select, since
+    gathering their statistics into arrays costs more than it saves.
+    """
+
+    @staticmethod
+    def uct_values(win_count, playout_count, parent_playout_count):
+        explore = 2 * math.log(parent_playout_count) if parent_playout_count else 0.0
+        visits = np.maximum(playout_count, 1)
+        values = win_count / visits + np.sqrt(explore / visits)
+        values[playout_count == 0] = 10000
+        return values
+
+    def select_index(self, tree, path=None):
+        i = 0
+        if path is not None:
+            path.append(i)
+        while tree.child_count[i]:
+            first = tree.first_child[i]
+            end = first + tree.child_count[i]
+            values = self.uct_values(tree.win_count[first:end],
+                                     tree.playout_count[first:end],
+                                     tree.playout_count[i])
+            i = first + int(np.argmax(values))
+            if path is not None:
+                path.append(i)
+        return i
+
+
+class ArrayMcTree(generic_mcts.McTree):
+    """ McTree storing its nodes in McTreeArrays instead of McTreeNode objects
+
+    Select policies may provide select_index(tree, path) to walk the arrays;
+    otherwise the plain UCT walk above is used. Only the node storage
+    hooks of McTree are overridden; transpositions, max_nodes and solver
+    need McTreeNode objects and are not supported.
+    """
+
+    UNSUPPORTED = ('transpositions', 'max_nodes', 'solver')
+
+    def __init__(self, game, select_policy, playout_policy, number_of_playouts,
+                 lazy_expansion=False, time_limit=None, node_limit=None,
+                 capacity=1024, **options):
+        unsupported = [name for name in self.UNSUPPORTED if options.get(name)]
+        assert not unsupported, f"ArrayMcTree does not support {', '.join(unsupported)}"
+        self.capacity = capacity
+        super().__init__(game, select_policy, playout_policy, number_of_playouts,
+                         lazy_expansion, time_limit, node_limit, **options)
+
+    def reset(self, game_state, move=None):
+        self.tree = McTreeArrays(self.capacity)
+        self.tree.add_root(game_state, move)
+        self.size = 1
+
+    @property
+    def root(self):
+        return ArrayNode(self.tree, 0)
+
+    def apply_move(self, move):
+        for child in self.tree.children(0):
+            if self.tree.move(child) == move:
+                self.materialize(child)
+                self.tree = self.tree.subtree(child)
+                self.size = self.tree.size
+                return
+        game_state = self.tree.game_states[0].copy()
+        self.game.apply_move(move, game_state)
+        self.reset(game_state, move)
+
+    def select(self, path):
+        if hasattr(self.select_policy, 'select_index'):
+            return self.select_policy.select_index(self.tree, path)
+        return uct_select_index(self.tree, path)
+
+    def expand(self, i):
+        tree = self.tree
+        parent_state = tree.game_states[i]
+        moves = self.game.possible_moves(parent_state)
+        if self.lazy_expansion:
+            game_states = [None] * len(moves)
+        else:
+            game_states = []
+            for move in moves:
+                game_state = parent_state.copy()
+                self.game.apply_move(move, game_state)
+                game_states.append(game_state)
+        tree.add_children(i, moves, game_states)
+        self.nodes += len(moves)
+        self.size = tree.size
+
+    def materialize(self, i):
+        """ Builds the state of a lazily expanded node from its parent """
+        tree = self.tree
+        if tree.game_states[i] is None:
+            game_state = tree.game_states[tree.parent[i]].copy()
+            self.game.apply_move(tree.move(i), game_state)
+            tree.game_states[i] = game_state
+        return tree.game_states[i]
+
+    def random_child(self, i):
+        return choice(self.tree.children(i)) if self.tree.child_count[i] else None
+
+    def add_visits(self, path, count):
+        self.tree.playout_count[path] += count
+
+    def backpropagate(self, i, result, path=None):
+        """ Scores node i and its parent once, alternating up the path """
+        tree = self.tree
+        scores = []
+        depth = 0
+        while i >= 0:
+            if depth < 2:
+                scores.append(self.game.score(result, tree.game_states[i]))
+            tree.playout_count[i] += 1
+            tree.win_count[i] += scores[depth % 2]
+            i = tree.parent[i]
+            depth += 1
+
+    def view(self, i):
+        return ArrayNode(self.tree, i)
+
+    def get_best_child(self):
+        children = self.tree.children(0)
+        visits = self.tree.playout_count[children.start:children.stop]
+        wins = self.tree.win_count[children.start:children.stop]
+        weights = np.divide(wins, visits, out=np.zeros(len(children)), where=visits > 0)
+        best = np.flatnonzero(weights == weights.max())
+        return children.start + choice(best)
+
+    def best_move(self):
+        return self.tree.move(self.get_best_child())
+
+    def memory_stats(self):
+        return {'nodes': self.tree.size, 'bytes': self.tree.nbytes()}
+
+    def root_child_stats(self):
+        return [(self.tree.move(c), float(self.tree.win_count[c]),
+                 int(self.tree.playout_count[c])) for c in self.tree.children(0)]
+
+    def tree_stats(self):
+        # a subtree copy holds exactly the nodes under the root
+        return {'positions': self.tree.size, 'links': self.tree.size - 1,
+                'transposition_hits': 0}
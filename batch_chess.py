@@ -0,0 +1,289 @@
+""" batched random chess playouts in numpy
+
+Revives the board representation of deprecated/chess.py: a piece is
+piece type << 1 | color and the empty square is 0. Boards are rows of 64
+squares, indexed like python-chess (a1 = 0, h8 = 63), so a batch of N
+games is one (N, 64) array advanced a ply at a time.
+
+Rules are simplified: there is no castling or en passant, pawns always
+promote to queens and repetitions are not detected. Games end in mate,
+stalemate, the 75-move rule or bare kings (with at most one minor piece).
+"""
+
+import numpy as np
+import chess
+
+WHITE = 0
+BLACK = 1
+DRAW = 2
+IN_PROGRESS = 3
+
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+
+# move geometry of a (from, to) square pair
+ORTHOGONAL = 0
+DIAGONAL = 1
+KNIGHT_JUMP = 2
+NO_MOVE = 3
+
+# what a piece may do along a pair: nothing, move or capture, move only
+# (pawn pushes) or capture only (pawn captures)
+FORBIDDEN, ANY, QUIET, CAPTURE = 0, 1, 2, 3
+
+ROOK_DIRECTIONS = np.array([[-1, 0], [+1, 0], [0, -1], [0, +1]])
+BISHOP_DIRECTIONS = np.array([[-1, -1], [-1, +1], [+1, -1], [+1, +1]])
+QUEEN_DIRECTIONS = np.concatenate((ROOK_DIRECTIONS, BISHOP_DIRECTIONS))
+KNIGHT_DIRECTIONS = np.array([[-2, -1], [-2, +1], [-1, -2], [-1, +2],
+                              [+1, -2], [+1, +2], [+2, -1], [+2, +1]])
+
+
+def _slot_tables():
+    """ Every (from, to) pair some piece could move along, plus one
+    dummy slot at the end that nothing can use """
+    frm, to, kind, dist, rank_delta, between = [], [], [], [], [], []
+    knight_jumps = {tuple(d) for d in KNIGHT_DIRECTIONS}
+    for a in range(64):
+        r1, c1 = divmod(a, 8)
+        for b in range(64):
+            r2, c2 = divmod(b, 8)
+            dr, dc = r2 - r1, c2 - c1
+            if a == b:
+                continue
+            if (dr, dc) in knight_jumps:
+                k = KNIGHT_JUMP
+            elif dr == 0 or dc == 0:
+                k = ORTHOGONAL
+            elif abs(dr) == abs(dc):
+                k = DIAGONAL
+            else:
+                continue
+            d = max(abs(dr), abs(dc))
+            mask = 0
+            if k != KNIGHT_JUMP:
+                for i in range(1, d):
+                    mask |= 1 << (8 * (r1 + i * np.sign(dr)) + c1 + i * np.sign(dc))
+            frm.append(a)
+            to.append(b)
+            kind.append(k)
+            dist.append(d)
+            rank_delta.append(dr)
+            between.append(mask)
+    frm.append(0)
+    to.append(0)
+    kind.append(NO_MOVE)
+    dist.append(0)
+    rank_delta.append(0)
+    between.append(0)
+    return (np.array(frm), np.array(to), np.array(kind), np.array(dist),
+            np.array(rank_delta), np.array(between, dtype=np.uint64))
+
+
+FROM, TO, KIND, DIST, RANK_DELTA, BETWEEN = _slot_tables()
+SLOTS = len(FROM) - 1
+SQUARE_BITS = np.uint64(1) << np.arange(64, dtype=np.uint64)
+
+
+def _move_modes():
+    """ MODES[piece, slot]: how piece may use slot, see ANY etc. """
+    modes = np.zeros((14, SLOTS + 1), dtype=np.int8)
+    kind, dist, dr = KIND[:SLOTS], DIST[:SLOTS], RANK_DELTA[:SLOTS]
+    from_rank = FROM[:SLOTS] // 8
+    line = (kind == ORTHOGONAL) | (kind == DIAGONAL)
+    for color, forward, start_rank in ((WHITE, 1, 1), (BLACK, -1, 6)):
+        straight = (kind == ORTHOGONAL) & (FROM[:SLOTS] % 8 == TO[:SLOTS] % 8)
+        push = straight & ((dr * forward == 1) | (dr * forward == 2) & (from_rank == start_rank))
+        capture = (kind == DIAGONAL) & (dist == 1) & (dr * forward == 1)
+        modes[PAWN << 1 | color, :SLOTS][push] = QUIET
+        modes[PAWN << 1 | color, :SLOTS][capture] = CAPTURE
+        modes[KNIGHT << 1 | color, :SLOTS][kind == KNIGHT_JUMP] = ANY
+        modes[BISHOP << 1 | color, :SLOTS][kind == DIAGONAL] = ANY
+        modes[ROOK << 1 | color, :SLOTS][kind == ORTHOGONAL] = ANY
+        modes[QUEEN << 1 | color, :SLOTS][line] = ANY
+        modes[KING << 1 | color, :SLOTS][line & (dist == 1)] = ANY
+    return modes
+
+
+MODES = _move_modes()
+
+
+def _outgoing():
+    """ OUTGOING[piece, square]: the slots piece may use from square,
+    padded with the dummy, and OUTGOING_MODES the matching MODES """
+    lists = [[np.flatnonzero((FROM == square) & (MODES[piece] != FORBIDDEN))
+              for square in range(64)] for piece in range(14)]
+    width = max(len(slots) for row in lists for slots in row)
+    outgoing = np.full((14, 64, width), SLOTS)
+    for piece, row in enumerate(lists):
+        for square, slots in enumerate(row):
+            outgoing[piece, square, :len(slots)] = slots
+    return outgoing, MODES[np.arange(14)[:, None, None], outgoing]
+
+
+OUTGOING, OUTGOING_MODES = _outgoing()
+
+
+def _incoming():
+    """ INCOMING[square]: the slots ending on square, padded with the dummy """
+    lists = [np.flatnonzero(TO[:SLOTS] == square) for square in range(64)]
+    width = max(len(slots) for slots in lists)
+    incoming = np.full((64, width), SLOTS)
+    for square, slots in enumerate(lists):
+        incoming[square, :len(slots)] = slots
+    return incoming
+
+
+INCOMING = _incoming()
+
+
+def from_boards(boards):
+    """ (squares, turn, halfmove clock) arrays for python-chess boards """
+    squares = np.zeros((len(boards), 64), dtype=np.int8)
+    for i, board in enumerate(boards):
+        for square, piece in board.piece_map().items():
+            squares[i, square] = piece.piece_type << 1 | (piece.color == chess.BLACK)
+    turn = np.array([board.turn == chess.BLACK for board in boards], dtype=np.int8)
+    halfmove = np.array([board.halfmove_clock for board in boards], dtype=np.int16)
+    return squares, turn, halfmove
+
+
+def occupancy(squares):
+    return np.where(squares != 0, SQUARE_BITS, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+
+
+def attacked(squares, occupied, target, by):
+    """ Whether square target of each board is attacked by color by """
+    slots = INCOMING[target]
+    piece = np.take_along_axis(squares, FROM[slots], axis=1)
+    mode = MODES[piece, slots]
+    attacker = (piece != 0) & ((piece & 1) == by[:, None]) & (mode != QUIET) & (mode != FORBIDDEN)
+    clear = (occupied[:, None] & BETWEEN[slots]) == 0
+    return (attacker & clear).any(axis=1)
+
+
+def pseudo_legal(squares, occupied, turn):
+    """ Candidate slots of the side to move's pieces, (N, 16 * width),
+    and the mask of the pseudo-legal ones among them """
+    own = (squares != 0) & ((squares & 1) == turn[:, None])
+    from_squares = np.argsort(~own, axis=1, kind='stable')[:, :16]
+    pieces = np.take_along_axis(squares * own, from_squares, axis=1)
+    slots = OUTGOING[pieces, from_squares].reshape(len(squares), -1)
+    mode = OUTGOING_MODES[pieces, from_squares].reshape(len(squares), -1)
+    target = np.take_along_axis(squares, TO[slots], axis=1)
+    empty = target == 0
+    enemy = ~empty & ((target & 1) != turn[:, None])
+    clear = (occupied[:, None] & BETWEEN[slots]) == 0
+    return slots, clear & (((mode == ANY) & (empty | enemy))
+                           | ((mode == QUIET) & empty)
+                           | ((mode == CAPTURE) & enemy))
+
+
+def king_squares(squares, color):
+    return np.argmax(squares == (KING << 1 | color)[:, None], axis=1)
+
+
+def sample(moves, rng):
+    """ A uniformly drawn set column per row, -1 for rows without one """
+    flat = np.flatnonzero(moves)
+    if not len(flat):
+        return np.full(len(moves), -1)
+    counts = np.bincount(flat // moves.shape[1], minlength=len(moves))
+    first = np.cumsum(counts) - counts
+    pick = first + (rng.random(len(moves)) * counts).astype(np.int64)
+    return np.where(counts > 0, flat[np.minimum(pick, len(flat) - 1)] % moves.shape[1], -1)
+
+
+def apply(squares, rows, slots):
+    """ Plays slots on squares[rows] in place; pawns promote to queens """
+    frm, to = FROM[slots], TO[slots]
+    piece = squares[rows, frm]
+    last_rank = (to // 8 == 7) | (to // 8 == 0)
+    promote = ((piece >> 1) == PAWN) & last_rank
+    squares[rows, to] = np.where(promote, QUEEN << 1 | (piece & 1), piece)
+    squares[rows, frm] = 0
+
+
+def leaves_check(squares, turn, slots):
+    """ Whether playing slots leaves the mover's king attacked """
+    after = squares.copy()
+    apply(after, np.arange(len(after)), slots)
+    return attacked(after, occupancy(after), king_squares(after, turn), 1 - turn)
+
+
+def choose_legal(squares, turn, slots, moves, rng, redraws=2):
+    """ Draws a legal move per board, -1 when a board has none
+
+    Draws leaving the king in check are cleared from moves and redrawn;
+    boards still failing after redraws get all their moves checked at
+    once, which is cheaper than redrawing one by one in check.
+    """
+    chosen = sample(moves, rng)
+    pending = np.flatnonzero(chosen >= 0)
+    for attempt in range(redraws + 1):
+        if not len(pending):
+            break
+        illegal = leaves_check(squares[pending], turn[pending], slots[pending, chosen[pending]])
+        pending = pending[illegal]
+        moves[pending, chosen[pending]] = False
+        chosen[pending] = sample(moves[pending], rng)
+        pending = pending[chosen[pending] >= 0]
+    if len(pending):
+        rows, columns = np.nonzero(moves[pending])
+        boards = pending[rows]
+        illegal = leaves_check(squares[boards], turn[boards], slots[boards, columns])
+        moves[boards[illegal], columns[illegal]] = False
+        chosen[pending] = sample(moves[pending], rng)
+    return np.where(chosen >= 0, slots[np.arange(len(slots)), chosen], -1)
+
+
+def insufficient_material(squares):
+    """ Bare kings, or kings and a single knight or bishop """
+    pieces = squares >> 1
+    heavy = ((pieces == PAWN) | (pieces == ROOK) | (pieces == QUEEN)).any(axis=1)
+    return ~heavy & ((squares != 0).sum(axis=1) <= 3)
+
+
+def random_playouts(squares, turn, halfmove, max_plies, rng=None):
+    """ Plays every board randomly for up to max_plies plies
+
+    Arrays are changed in place. Returns the result per board (WHITE,
+    BLACK, DRAW or IN_PROGRESS) and the number of plies played in total.
+    """
+    rng = rng or np.random.default_rng()
+    result = np.full(len(squares), IN_PROGRESS, dtype=np.int8)
+    result[insufficient_material(squares)] = DRAW
+    active = np.flatnonzero(result == IN_PROGRESS)
+    plies = 0
+    for ply in range(max_plies + 1):
+        if not len(active):
+            break
+        board, side = squares[active], turn[active]
+        occupied = occupancy(board)
+        slots, moves = pseudo_legal(board, occupied, side)
+        chosen = choose_legal(board, side, slots, moves, rng)
+        stuck = chosen < 0
+        if stuck.any():
+            rows = active[stuck]
+            check = attacked(board[stuck], occupied[stuck],
+                             king_squares(board[stuck], side[stuck]), 1 - side[stuck])
+            result[rows] = np.where(check, 1 - side[stuck], DRAW)
+        clock = halfmove[active] >= 150
+        result[active[clock & ~stuck]] = DRAW
+        keep = ~stuck & ~clock
+        active, board, chosen = active[keep], board[keep], chosen[keep]
+        if ply == max_plies or not len(active):
+            break
+        capture = board[np.arange(len(active)), TO[chosen]] != 0
+        pawn = (board[np.arange(len(active)), FROM[chosen]] >> 1) == PAWN
+        apply(board, np.arange(len(active)), chosen)
+        squares[active] = board
+        turn[active] ^= 1
+        halfmove[active] = np.where(capture | pawn, 0, halfmove[active] + 1)
+        plies += len(active)
+        result[active[insufficient_material(board)]] = DRAW
+        active = active[result[active] == IN_PROGRESS]
+    return result, plies
@@ -0,0 +1,458 @@
+""" search and evaluation benchmarks, run as: python benchmarks.py [name ...] """
+
+import sys
+import time
+import random
+import tracemalloc
+import chess
+import generic_mcts
+import array_mcts
+import generic_alpha_beta
+from chess_ai import Game
+from chess_ai import ChessMoveOrdering
+from chess_ai import ChessQuiescence
+from chess_ai import ChessNullMovePruning
+from chess_ai import ChessLateMoveReductions
+from chess_ai import encode_move, decode_move
+from chess_ai import score_board_with_pos_bias
+from chess_ai import score_board_bitboard
+from chess_ai import score_board_incremental
+from chess_ai import IncrementalEvalBoard
+from chess_ai import UniformRandomPlayoutPolicy
+from chess_ai import FastRandomPlayoutPolicy
+from chess_ai import TruncatedPlayoutPolicy
+from chess_ai import BatchRandomPlayoutPolicy
+from chess_ai import score_board_stockfish, load_stockfish, close_stockfish
+from xo import XoGame, XoUniformRandomPlayoutPolicy
+
+
+POSITIONS = [
+    chess.STARTING_FEN,
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+]
+
+
+def search_nodes(board, depth, **options):
+    search = generic_alpha_beta.Search(**options)
+    start = time.perf_counter()
+    generic_alpha_beta.choose_best_move_minimax(
+        Game, board, score_board_with_pos_bias, depth,
+        board.turn == chess.WHITE, search
+    )
+    return search.nodes, time.perf_counter() - start
+
+
+def bench_move_ordering(depths=(3, 4, 5)):
+    print("move ordering: nodes (seconds), generation order vs ordered")
+    for depth in depths:
+        total_plain = total_ordered = 0
+        for fen in POSITIONS:
+            board = chess.Board(fen)
+            plain, plain_t = search_nodes(board, depth)
+            ordered, ordered_t = search_nodes(
+                board, depth, ordering=ChessMoveOrdering()
+            )
+            total_plain += plain
+            total_ordered += ordered
+            print(f"  depth {depth} {plain:>9} ({plain_t:.2f}s) "
+                  f"{ordered:>9} ({ordered_t:.2f}s)  {fen}")
+        print(f"depth {depth}: {total_ordered / total_plain:.1%} of the nodes")
+
+
+def bench_quiescence(depths=(1, 2, 3)):
+    print("quiescence: full-width nodes, quiescence nodes, deepest ply")
+    for depth in depths:
+        for fen in POSITIONS:
+            board = chess.Board(fen)
+            search = generic_alpha_beta.Search(
+                ordering=ChessMoveOrdering(), quiescence=ChessQuiescence()
+            )
+            start = time.perf_counter()
+            generic_alpha_beta.choose_best_move_minimax(
+                Game, board, score_board_with_pos_bias, depth,
+                board.turn == chess.WHITE, search
+            )
+            elapsed = time.perf_counter() - start
+            print(f"  depth {depth} {search.nodes:>8} {search.qnodes:>8} "
+                  f"{search.max_ply:>3} ({elapsed:.2f}s)  {fen}")
+
+
+def bench_lazy_smp(threads=(1, 2, 4, 8, 16, 32), depth=4):
+    print(f"lazy smp: time to depth {depth} over the position suite")
+    base = None
+    for n in threads:
+        smp = generic_alpha_beta.LazySmp(n, 64, encode_move, decode_move)
+        elapsed = nodes = 0
+        for fen in POSITIONS:
+            board = chess.Board(fen)
+            smp.tt.clear()
+            start = time.perf_counter()
+            smp.choose_best_move(
+                Game, board, score_board_with_pos_bias, depth,
+                board.turn == chess.WHITE, ordering=ChessMoveOrdering()
+            )
+            elapsed += time.perf_counter() - start
+            nodes += smp.nodes
+        smp.close()
+        base = base or elapsed
+        print(f"  {n:>2} workers {elapsed:7.2f}s {nodes:>9} nodes "
+              f"speedup {base / elapsed:.2f}")
+
+
+def bench_pruning(depths=(3, 4, 5)):
+    print("null move / lmr: nodes (seconds) with ordering, tt and pvs")
+    configs = [
+        ('baseline', {}),
+        ('null move', {'null_move': ChessNullMovePruning()}),
+        ('lmr', {'lmr': ChessLateMoveReductions()}),
+        ('both', {'null_move': ChessNullMovePruning(),
+                  'lmr': ChessLateMoveReductions()}),
+    ]
+    for depth in depths:
+        for name, options in configs:
+            nodes = elapsed = 0
+            for fen in POSITIONS:
+                n, t = search_nodes(
+                    chess.Board(fen), depth, ordering=ChessMoveOrdering(),
+                    tt=generic_alpha_beta.TranspositionTable(16), pvs=True,
+                    **options
+                )
+                nodes += n
+                elapsed += t
+            print(f"  depth {depth} {name:<10} {nodes:>9} ({elapsed:.2f}s)")
+
+
+def random_boards(count, seed=0, board_type=chess.Board):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = board_type()
+        for _ in range(rng.randrange(0, 120)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        boards.append(board)
+    return boards
+
+
+def bench_evaluators(count=2000, repeat=5):
+    print("evaluations per second on random positions")
+    boards = random_boards(count)
+    incremental_boards = random_boards(count, board_type=IncrementalEvalBoard)
+    evaluators = [
+        ('score_board_with_pos_bias', score_board_with_pos_bias, boards),
+        ('score_board_bitboard', score_board_bitboard, boards),
+        ('score_board_bitboard (no mate test)',
+         lambda board: score_board_bitboard(board, has_legal_moves=True), boards),
+        ('score_board_incremental', score_board_incremental, incremental_boards),
+    ]
+    for name, evaluate, positions in evaluators:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for board in positions:
+                evaluate(board)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<38} {count * repeat / elapsed:>10.0f}/s")
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(c) for c in node.children)
+
+
+def drop_game_states(mct):
+    if isinstance(mct, array_mcts.ArrayMcTree):
+        mct.tree.game_states = [None] * mct.tree.size
+        return
+    stack = [mct.root]
+    while stack:
+        node = stack.pop()
+        node.game_state = None
+        stack.extend(node.children)
+
+
+def bench_mcts_tree():
+    print("mcts trees: nodes/s, bytes per node with and without game states")
+    cases = [
+        ('chess', Game, UniformRandomPlayoutPolicy(20), 1000),
+        ('xo', XoGame, XoUniformRandomPlayoutPolicy(), 20000),
+    ]
+    for game_name, game, playout_policy, n in cases:
+        for name, tree_type in (('objects', generic_mcts.McTree),
+                                ('arrays', array_mcts.ArrayMcTree)):
+            random.seed(0)
+            tracemalloc.start()
+            start = time.perf_counter()
+            mct = tree_type(game, generic_mcts.UctSelectPolicy(),
+                            playout_policy, n)
+            mct.choose_best_move()
+            elapsed = time.perf_counter() - start
+            if tree_type is array_mcts.ArrayMcTree:
+                nodes = mct.tree.size
+            else:
+                nodes = count_nodes(mct.root)
+            with_states = tracemalloc.get_traced_memory()[0]
+            drop_game_states(mct)
+            without_states = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"  {game_name:<5} {n:>5} playouts {name:<8} {nodes:>7} nodes "
+                  f"{nodes / elapsed:>8.0f} nodes/s "
+                  f"{with_states / nodes:>6.0f} B/node "
+                  f"{without_states / nodes:>5.0f} B/node without states")
+
+
+def bench_lazy_expansion(playouts=1000, max_playout_len=20):
+    print("lazy expansion: time and memory per playout from the start position")
+    for name, tree_type in (('objects', generic_mcts.McTree),
+                            ('arrays', array_mcts.ArrayMcTree)):
+        for lazy in (False, True):
+            def search():
+                random.seed(0)
+                mct = tree_type(Game, generic_mcts.UctSelectPolicy(),
+                                UniformRandomPlayoutPolicy(max_playout_len),
+                                playouts, lazy_expansion=lazy)
+                return mct, mct.choose_best_move()
+            start = time.perf_counter()
+            search()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            mct, move = search()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"  {name:<8} lazy={lazy!s:<5} "
+                  f"{elapsed / playouts * 1000:6.2f} ms/playout "
+                  f"{memory / playouts:>8.0f} B/playout  best {move}")
+
+
+def star_trees(branching, seed=0):
+    """ A root with visited leaf children, as object and array trees """
+    rng = random.Random(seed)
+    root = generic_mcts.McTreeNode(None)
+    arrays = array_mcts.McTreeArrays()
+    arrays.add_root(None)
+    arrays.add_children(0, list(range(branching)), [None] * branching)
+    for i in range(branching):
+        child = generic_mcts.McTreeNode(None, i, root)
+        child.playout_count = rng.randrange(1, 100)
+        child.win_count = rng.randrange(0, child.playout_count + 1)
+        root.children.append(child)
+        root.playout_count += child.playout_count
+        arrays.playout_count[1 + i] = child.playout_count
+        arrays.win_count[1 + i] = child.win_count
+    arrays.playout_count[0] = root.playout_count
+    return root, arrays
+
+
+def bench_uct_select(branching=(2, 8, 20, 40, 100, 400), repeat=2000):
+    print("uct selection: microseconds per select over one level of children")
+    print(f"  {'children':>8} {'objects':>9} {'arrays':>9} {'vector/arrays':>14}")
+    scalar = generic_mcts.UctSelectPolicy()
+    vector = array_mcts.VectorUctSelectPolicy()
+    for b in branching:
+        root, arrays = star_trees(b)
+        assert (scalar.select(root).move == array_mcts.uct_select_index(arrays) - 1
+                == vector.select_index(arrays) - 1)
+        timings = []
+        for select, tree in ((scalar.select, root),
+                             (array_mcts.uct_select_index, arrays),
+                             (vector.select_index, arrays)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                select(tree)
+            timings.append((time.perf_counter() - start) / repeat * 1e6)
+        print(f"  {b:>8} {timings[0]:>9.1f} {timings[1]:>9.1f} {timings[2]:>14.1f}")
+
+
+def bench_root_parallel(workers=(1, 2, 4, 8), playouts=200, moves=3):
+    print(f"root parallel mcts: {playouts} playouts per tree, {moves} moves")
+    for n in workers:
+        random.seed(0)
+        mct = generic_mcts.RootParallelMcTree(
+            Game, generic_mcts.UctSelectPolicy(),
+            UniformRandomPlayoutPolicy(20), playouts, workers=n,
+            lazy_expansion=True,
+        )
+        start = time.perf_counter()
+        for _ in range(moves):
+            mct.apply_move(mct.choose_best_move())
+        elapsed = time.perf_counter() - start
+        mct.close()
+        print(f"  {n:>2} workers {elapsed:6.2f}s "
+              f"{n * playouts * moves / elapsed:>7.0f} playouts/s")
+
+
+def bench_tree_parallel(workers=(1, 2, 4, 8, 16), playouts=400):
+    print(f"tree parallel mcts with virtual loss: {playouts} playouts")
+    for n in workers:
+        random.seed(0)
+        mct = generic_mcts.TreeParallelMcTree(
+            Game, generic_mcts.UctSelectPolicy(),
+            UniformRandomPlayoutPolicy(20), playouts, workers=n,
+            lazy_expansion=True,
+        )
+        start = time.perf_counter()
+        move = mct.choose_best_move()
+        elapsed = time.perf_counter() - start
+        mct.close()
+        print(f"  {n:>2} workers {elapsed:6.2f}s {playouts / elapsed:>7.0f} playouts/s"
+              f"  {count_nodes(mct.root):>6} nodes  best {move}")
+
+
+def bench_transpositions(playouts=(1000, 3000), max_playout_len=20):
+    print("mcts transpositions: distinct positions vs links after one search")
+    for n in playouts:
+        for transpositions in (False, True):
+            random.seed(0)
+            mct = generic_mcts.McTree(
+                Game, generic_mcts.UctSelectPolicy(),
+                UniformRandomPlayoutPolicy(max_playout_len), n,
+                lazy_expansion=True, transpositions=transpositions,
+            )
+            start = time.perf_counter()
+            mct.choose_best_move()
+            elapsed = time.perf_counter() - start
+            stats = mct.tree_stats()
+            print(f"  {n:>5} playouts transpositions={transpositions!s:<5} "
+                  f"{stats['positions']:>7} positions {stats['links']:>7} links "
+                  f"{stats['transposition_hits']:>6} hits ({elapsed:.2f}s)")
+
+
+def bench_playouts(playouts=200, max_playout_len=100):
+    print("random playouts: plies per second over the position suite")
+    push = chess.Board.push
+    plies = 0
+
+    def counting_push(board, move):
+        nonlocal plies
+        plies += 1
+        push(board, move)
+
+    nodes = [generic_mcts.McTreeNode(chess.Board(fen)) for fen in POSITIONS]
+    chess.Board.push = counting_push
+    try:
+        for name, policy in (
+            ('UniformRandomPlayoutPolicy', UniformRandomPlayoutPolicy(max_playout_len)),
+            ('FastRandomPlayoutPolicy', FastRandomPlayoutPolicy(max_playout_len)),
+        ):
+            random.seed(0)
+            plies = 0
+            start = time.perf_counter()
+            for node in nodes:
+                for _ in range(playouts):
+                    policy.playout(node)
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<28} {plies / elapsed:>8.0f} plies/s "
+                  f"{len(nodes) * playouts / elapsed:>6.0f} playouts/s")
+    finally:
+        chess.Board.push = push
+
+
+HANGING_QUEEN = ('rnb1kbnr/pppp1ppp/8/4p3/3q4/4P3/PPPP1PPP/RNBQKBNR w KQkq - 0 3', 'e3d4')
+
+
+def bench_truncated_playouts(playouts=300, trials=10):
+    fen, best = HANGING_QUEEN
+    print(f"truncated playouts: {playouts} playouts, how often {best} wins the queen")
+    load_stockfish()
+    try:
+        for name, policy in (
+            ('random, 100 plies', FastRandomPlayoutPolicy(100)),
+            ('pos bias, 8 plies', TruncatedPlayoutPolicy(score_board_with_pos_bias, 8)),
+            ('pos bias, 2 plies', TruncatedPlayoutPolicy(score_board_with_pos_bias, 2)),
+            ('stockfish, 2 plies', TruncatedPlayoutPolicy(score_board_stockfish, 2, scale=400)),
+        ):
+            found = 0
+            policy.plies = 0
+            start = time.perf_counter()
+            for seed in range(trials):
+                random.seed(seed)
+                mct = generic_mcts.McTree(Game, generic_mcts.UctSelectPolicy(),
+                                          policy, playouts)
+                mct.root.game_state = chess.Board(fen)
+                found += mct.choose_best_move() == chess.Move.from_uci(best)
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<20} {found:>3}/{trials} "
+                  f"{policy.plies / (trials * playouts):6.1f} plies/playout "
+                  f"{elapsed / trials:6.2f}s/search")
+    finally:
+        close_stockfish()
+
+
+def bench_batch_playouts(max_playout_len=100, batch_sizes=(1, 4, 16, 64, 256, 1024, 4096)):
+    print("batched playouts: playouts per second against one game at a time")
+    policy = FastRandomPlayoutPolicy(max_playout_len)
+    nodes = [generic_mcts.McTreeNode(chess.Board(fen)) for fen in POSITIONS]
+    random.seed(0)
+    start = time.perf_counter()
+    for node in nodes * 20:
+        policy.playout(node)
+    elapsed = time.perf_counter() - start
+    print(f"  {'FastRandomPlayoutPolicy':<28} {len(nodes) * 20 / elapsed:>8.0f} playouts/s")
+    policy = BatchRandomPlayoutPolicy(max_playout_len)
+    for size in batch_sizes:
+        batch = [nodes[i % len(nodes)] for i in range(size)]
+        rounds = max(1, 256 // size)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            policy.playout_many(batch)
+        elapsed = time.perf_counter() - start
+        print(f"  {'batch of ' + str(size):<28} {size * rounds / elapsed:>8.0f} playouts/s")
+    for size in (1, 64, 256):
+        random.seed(0)
+        mct = generic_mcts.McTree(Game, generic_mcts.UctSelectPolicy(),
+                                  BatchRandomPlayoutPolicy(max_playout_len), 1024,
+                                  batch_size=size)
+        start = time.perf_counter()
+        mct.search()
+        elapsed = time.perf_counter() - start
+        print(f"  {'search, batch_size ' + str(size):<28} {mct.playouts / elapsed:>8.0f} playouts/s")
+
+
+MATES = [
+    ('back rank mate in 1', '6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1'),
+    ('scholar mate in 1', 'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4'),
+    ('rook mate in 2', '2k5/8/1K6/8/8/8/8/3R4 w - - 0 1'),
+]
+
+
+def bench_solver(playouts=3000):
+    print(f"MCTS-Solver: playouts and time spent on forced mates, budget {playouts}")
+    for name, fen in MATES:
+        for solver in (False, True):
+            random.seed(0)
+            mct = generic_mcts.McTree(Game, generic_mcts.UctSelectPolicy(),
+                                      FastRandomPlayoutPolicy(50), playouts, solver=solver)
+            mct.root.game_state = chess.Board(fen)
+            start = time.perf_counter()
+            move = mct.choose_best_move()
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<20} solver={solver!s:<5} {str(move):<6} {mct.playouts:>5} playouts "
+                  f"{elapsed:6.2f}s proven={mct.root.proven}")
+
+
+BENCHMARKS = {
+    'ordering': bench_move_ordering,
+    'quiescence': bench_quiescence,
+    'smp': bench_lazy_smp,
+    'pruning': bench_pruning,
+    'eval': bench_evaluators,
+    'mcts_tree': bench_mcts_tree,
+    'lazy': bench_lazy_expansion,
+    'uct': bench_uct_select,
+    'root_parallel': bench_root_parallel,
+    'tree_parallel': bench_tree_parallel,
+    'transpositions': bench_transpositions,
+    'playouts': bench_playouts,
+    'truncated': bench_truncated_playouts,
+    'batch': bench_batch_playouts,
+    'solver': bench_solver,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,8 +1,19 @@
+import os
+import sys
 import chess
+import queue
 import random
+import sqlite3
 import platform
+import threading
+import contextlib
+import concurrent.futures
+from collections import OrderedDict, namedtuple
 import chess.engine
+import chess.polyglot
 import generic_mcts
+import array_mcts
+import batch_chess
 from generic_mcts import Move
 import generic_alpha_beta
 from generic_alpha_beta import choose_best_move_minimax
@@ -11,8 +22,7 @@ from colorama import Style
 from random import choice
 
 
-def load_stockfish():
-    global stockfish
+def stockfish_path():
     system = platform.system()
     if system == 'Linux':
         fn = './stockfish/stockfish_linux'
@@ -20,7 +30,177 @@ def load_stockfish():
         fn = './stockfish/stockfish_windows.exe'
     elif system == 'Darwin':
         fn = './stockfish/stockfish_mac'
-    stockfish = chess.engine.SimpleEngine.popen_uci(fn)
+    return fn
+
+
+ENGINE_ERRORS = (
+    chess.engine.EngineError,
+    chess.engine.EngineTerminatedError,
+    concurrent.futures.TimeoutError,
+)
+
+
+class StockfishPool:
+    """ N Stockfish processes shared by any number of threads
+
+    Evaluating checks an engine out, so concurrent callers never share a
+    process. An engine that fails is restarted and the evaluation retried
+    once; if the restart fails too, the next checkout of its slot tries
+    again, so the pool keeps its size. Pickling keeps only the settings, and an unpickled pool starts
+    its own engines, so a pool can be handed to worker processes.
+    """
+
+    def __init__(self, size=1, path=None, depth=1):
+        self.size = size
+        self.path = path or stockfish_path()
+        self.depth = depth
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.engines = []
+        self.idle = queue.Queue()
+        self.executor = None
+        for _ in range(size):
+            self.idle.put(self.start_engine())
+
+    def __getstate__(self):
+        return (self.size, self.path, self.depth)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def settings(self):
+        """ What the evaluations depend on, for EvalCache """
+        return f'stockfish {self.path} depth={self.depth}'
+
+    def start_engine(self):
+        engine = chess.engine.SimpleEngine.popen_uci(self.path)
+        with self.lock:
+            self.engines.append(engine)
+        return engine
+
+    def stop_engine(self, engine):
+        with self.lock:
+            self.engines.remove(engine)
+        try:
+            engine.quit()
+        except ENGINE_ERRORS:
+            engine.close()
+
+    def restart_engine(self, engine):
+        self.stop_engine(engine)
+        self.restarts += 1
+        return self.start_engine()
+
+    def checkout(self, timeout=None):
+        """ An idle engine; the slot of an engine lost to a failed restart
+        (None in idle) starts a new one first """
+        engine = self.idle.get(timeout=timeout)
+        if engine is None:
+            try:
+                engine = self.start_engine()
+            except BaseException:
+                self.idle.put(None)
+                raise
+        return engine
+
+    def checkin(self, engine):
+        self.idle.put(engine)
+
+    def release(self, engine):
+        """ checkin, or keep the slot as None if a failed restart already
+        stopped the engine, so the pool never shrinks """
+        with self.lock:
+            alive = engine in self.engines
+        self.checkin(engine if alive else None)
+
+    @contextlib.contextmanager
+    def engine(self):
+        engine = self.checkout()
+        try:
+            yield engine
+        finally:
+            self.release(engine)
+
+    @staticmethod
+    def is_healthy(engine):
+        try:
+            engine.ping()
+        except ENGINE_ERRORS:
+            return False
+        return True
+
+    def health_check(self):
+        """ Pings every idle engine and restarts the ones that do not
+        answer; empty slots get a new engine """
+        engines = []
+        while True:
+            try:
+                engines.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            while engines:
+                engine = engines.pop()
+                try:
+                    if engine is None:
+                        engine = self.start_engine()
+                    elif not self.is_healthy(engine):
+                        engine = self.restart_engine(engine)
+                finally:
+                    self.release(engine)
+        finally:
+            for engine in engines:
+                self.checkin(engine)
+
+    def evaluate(self, board):
+        limit = chess.engine.Limit(depth=self.depth)
+        engine = self.checkout()
+        try:
+            try:
+                info = engine.analyse(board, limit, info=chess.engine.INFO_SCORE)
+            except ENGINE_ERRORS:
+                engine = self.restart_engine(engine)
+                info = engine.analyse(board, limit, info=chess.engine.INFO_SCORE)
+        finally:
+            self.release(engine)
+        return info['score'].white().score(mate_score=10000)
+
+    __call__ = evaluate
+
+    def evaluate_many(self, boards):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.size)
+        return list(self.executor.map(self.evaluate, boards))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for engine in list(self.engines):
+            self.stop_engine(engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+stockfish = None
+
+
+def load_stockfish(size=1, depth=1):
+    global stockfish
+    if stockfish is None:
+        stockfish = StockfishPool(size, depth=depth)
+    return stockfish
+
+
+def close_stockfish():
+    global stockfish
+    if stockfish is not None:
+        stockfish.close()
+        stockfish = None
 
 
 class UniformRandomPlayoutPolicy:
@@ -31,13 +211,165 @@ class UniformRandomPlayoutPolicy:
         state = node.game_state.copy()
         for _ in range(self.max_playout_len):
             if state.result() != '*':
-                return
+                break
             move = choice(list(state.legal_moves))
             state.push(move)
 
         return Game.status(state)
 
 
+class FastRandomPlayoutPolicy:
+    """ Uniform random playouts without board.result() every ply
+
+    The board is copied without its move stack. A move is drawn from the
+    pseudo-legal moves and redrawn until one does not leave the king in
+    check, so only the drawn moves are built and tested for legality. Terminal
+    states are found along the way: no legal move means mate or
+    stalemate, the 75-move rule is a clock test, and insufficient
+    material is only rechecked after captures and promotions. Without the stack,
+    fivefold repetition is not detected. Returns the game status where
+    the playout stopped.
+    """
+
+    def __init__(self, max_playout_len=100):
+        self.max_playout_len = max_playout_len
+        self.plies = 0
+
+    @staticmethod
+    def random_pseudo_legal_move(board):
+        """ Uniform over the pseudo-legal moves; piece moves are counted
+        from attack masks and only the chosen one is built """
+        us = board.occupied_co[board.turn]
+        targets = []
+        total = 0
+        for square in chess.scan_reversed(us & ~board.pawns):
+            mask = board.attacks_mask(square) & ~us
+            if mask:
+                n = chess.popcount(mask)
+                targets.append((square, mask, n))
+                total += n
+        others = list(board.generate_pseudo_legal_moves(board.pawns & us))
+        others += board.generate_castling_moves()
+        r = random.randrange(total + len(others)) if total or others else None
+        if r is None:
+            return None
+        if r >= total:
+            return others[r - total]
+        for square, mask, n in targets:
+            if r < n:
+                for to_square in chess.scan_forward(mask):
+                    if r == 0:
+                        return chess.Move(square, to_square)
+                    r -= 1
+            r -= n
+
+    @classmethod
+    def random_legal_move(cls, board, tries=8):
+        if not board.is_check():
+            for _ in range(tries):
+                move = cls.random_pseudo_legal_move(board)
+                if move is None:
+                    break
+                if not board.is_into_check(move):
+                    return move
+        moves = list(board.generate_legal_moves())
+        return choice(moves) if moves else None
+
+    def playout(self, node):
+        return self.simulate(node.game_state.copy(stack=False))
+
+    def simulate(self, board):
+        """ Plays on board in place and returns the status it stopped at """
+        if board.is_insufficient_material():
+            return Status.DRAW
+        for ply in range(self.max_playout_len + 1):
+            move = self.random_legal_move(board)
+            if move is None:
+                if board.is_check():
+                    return Status.BLACK_WIN if board.turn == chess.WHITE else Status.WHITE_WIN
+                return Status.DRAW
+            if board.halfmove_clock >= 150:
+                return Status.DRAW
+            if ply == self.max_playout_len:
+                return Status.IN_PROGRESS
+            material_changed = move.promotion or board.is_capture(move)
+            board.push(move)
+            self.plies += 1
+            if material_changed and board.is_insufficient_material():
+                return Status.DRAW
+
+
+# result of a playout cut short: the chance that white wins
+WinProbability = namedtuple('WinProbability', 'white')
+
+
+def win_probability(score, scale=400):
+    """ Logistic curve from a white-positive score; scale is the score
+    at which white is ten times as likely to win as black """
+    exponent = max(-20.0, min(20.0, -score / scale))
+    return 1 / (1 + 10 ** exponent)
+
+
+class TruncatedPlayoutPolicy(FastRandomPlayoutPolicy):
+    """ Random playouts cut after max_playout_len plies and scored statically
+
+    A playout that ends the game returns its status, otherwise the
+    heuristic's white-positive score of the last position becomes a
+    WinProbability. scale=40 fits score_board_with_pos_bias (pawn = 10)
+    and 400 the centipawns of score_board_stockfish.
+    """
+
+    def __init__(self, heuristic, max_playout_len=8, scale=40):
+        super().__init__(max_playout_len)
+        self.heuristic = heuristic
+        self.scale = scale
+
+    def playout(self, node):
+        board = node.game_state.copy(stack=False)
+        status = self.simulate(board)
+        if status != Status.IN_PROGRESS:
+            return status
+        return WinProbability(win_probability(self.heuristic(board), self.scale))
+
+
+class BatchRandomPlayoutPolicy:
+    """ Uniform random playouts of many leaves at once in batch_chess
+
+    playout_many advances all boards a ply at a time in numpy arrays, so
+    it pays off with an McTree batch_size in the hundreds. The rules are
+    simplified there: no castling, no en passant, queen promotions only.
+    """
+
+    def __init__(self, max_playout_len=100):
+        self.max_playout_len = max_playout_len
+        self.plies = 0
+
+    def playout(self, node):
+        return self.playout_many([node])[0]
+
+    def playout_many(self, nodes):
+        squares, turn, halfmove = batch_chess.from_boards([n.game_state for n in nodes])
+        results, plies = batch_chess.random_playouts(squares, turn, halfmove,
+                                                     self.max_playout_len)
+        self.plies += plies
+        statuses = {
+            batch_chess.WHITE: Status.WHITE_WIN,
+            batch_chess.BLACK: Status.BLACK_WIN,
+            batch_chess.DRAW: Status.DRAW,
+            batch_chess.IN_PROGRESS: Status.IN_PROGRESS,
+        }
+        return [statuses[r] for r in results]
+
+
+def encode_move(move):
+    promotion = move.promotion or 0
+    return move.from_square | move.to_square << 6 | promotion << 12
+
+
+def decode_move(code):
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
 class Status:
     IN_PROGRESS = 0
     DRAW = 1
@@ -60,8 +392,12 @@ class Game(generic_mcts.Game):
 
     @staticmethod
     def score(result, game_state):
-        if ((result == Status.WHITE_WIN and game_state.turn == chess.WHITE)
-           or (result == Status.BLACK_WIN and game_state.turn == chess.BLACK)):
+        # a node is scored for the player who moved into it, as in xo
+        mover = not game_state.turn
+        if isinstance(result, WinProbability):
+            return result.white if mover == chess.WHITE else 1 - result.white
+        if ((result == Status.WHITE_WIN and mover == chess.WHITE)
+           or (result == Status.BLACK_WIN and mover == chess.BLACK)):
             return 1
         elif result == Status.DRAW:
             return 0.25
@@ -80,6 +416,10 @@ class Game(generic_mcts.Game):
     def possible_moves(game_state):
         return list(game_state.legal_moves)
 
+    @staticmethod
+    def hash_state(game_state):
+        return chess.polyglot.zobrist_hash(game_state)
+
     @staticmethod
     def initial_state():
         return chess.Board()
@@ -124,16 +464,121 @@ class Game(generic_mcts.Game):
             print()
 
 
+class ChessMoveOrdering(generic_alpha_beta.MoveOrdering):
+    def score_move(self, game, game_state, move):
+        if move.promotion is not None:
+            return 100 + move.promotion
+        if game_state.is_capture(move):
+            # MVV-LVA: most valuable victim first, cheapest attacker breaks ties
+            if game_state.is_en_passant(move):
+                victim = chess.PAWN
+            else:
+                victim = game_state.piece_type_at(move.to_square)
+            attacker = game_state.piece_type_at(move.from_square)
+            return 10 * victim - attacker
+        return 0
+
+
+class ChessQuiescence(generic_alpha_beta.Quiescence):
+    def __init__(self, delta_margin=20):
+        super().__init__(delta_margin)
+
+    def noisy_moves(self, game, game_state):
+        moves = list(game_state.generate_legal_captures())
+        if game_state.turn == chess.WHITE:
+            promotion_rank = chess.BB_RANK_7
+        else:
+            promotion_rank = chess.BB_RANK_2
+        pawns = game_state.pawns & game_state.occupied_co[game_state.turn] & promotion_rank
+        if pawns:
+            # captures with promotion are already in the list above
+            moves.extend(game_state.generate_legal_moves(pawns, ~game_state.occupied))
+        # cheapest attacker first; the search then sorts stably by gain
+        moves.sort(key=lambda move: game_state.piece_type_at(move.from_square))
+        return moves
+
+    def gain(self, game, game_state, move):
+        gain = 0
+        if game_state.is_en_passant(move):
+            gain = PIECE_VAL[chess.PAWN]
+        elif game_state.is_capture(move):
+            gain = PIECE_VAL[game_state.piece_type_at(move.to_square)]
+        if move.promotion is not None:
+            gain += PIECE_VAL[move.promotion] - PIECE_VAL[chess.PAWN]
+        return gain
+
+
+class ChessNullMovePruning(generic_alpha_beta.NullMovePruning):
+    def allowed(self, game, game_state):
+        if game_state.is_check():
+            return False
+        # never two passes in a row
+        if game_state.move_stack and not game_state.peek():
+            return False
+        # with only king and pawns left zugzwang is common, so do not pass
+        pieces = game_state.occupied_co[game_state.turn] & ~(
+            game_state.pawns | game_state.kings)
+        return pieces != 0
+
+    def apply(self, game, game_state):
+        game_state.push(chess.Move.null())
+
+    def undo(self, game, game_state):
+        game_state.pop()
+
+
+class ChessLateMoveReductions(generic_alpha_beta.LateMoveReductions):
+    def can_reduce(self, game, game_state, move):
+        return not (
+            move.promotion is not None
+            or game_state.is_capture(move)
+            or game_state.is_check()
+            or game_state.gives_check(move)
+        )
+
+
+# bytes held per McTree node with its board, see benchmarks.py mcts_tree
+CHESS_NODE_BYTES = 1700
+
+
 class ChessMctsPlayer(generic_mcts.AiPlayer):
     def __init__(self, playout_policy=UniformRandomPlayoutPolicy(),
-                 max_playout_len=50, number_of_playouts=200, colors=False):
+                 max_playout_len=50, number_of_playouts=None, colors=False,
+                 array_tree=False, lazy_expansion=False,
+                 select_policy=generic_mcts.UctSelectPolicy(), workers=1,
+                 tree_parallel=False, time_limit=None, node_limit=None,
+                 transpositions=False, max_nodes=None, max_tree_mb=None,
+                 batch_size=1, solver=False):
         self.game = Game
         self.colors = colors
-        self.mct = generic_mcts.McTree(
+        if number_of_playouts is None and time_limit is None and node_limit is None:
+            # 200 playouts unless the search is budgeted otherwise
+            number_of_playouts = 200
+        tree_type = array_mcts.ArrayMcTree if array_tree else generic_mcts.McTree
+        options = {'transpositions': True} if transpositions else {}
+        if max_tree_mb is not None:
+            max_nodes = int(max_tree_mb * 2 ** 20 / CHESS_NODE_BYTES)
+        if max_nodes is not None:
+            options['max_nodes'] = max_nodes
+        if batch_size > 1:
+            options['batch_size'] = batch_size
+        if solver:
+            options['solver'] = True
+        if workers > 1 and tree_parallel:
+            options['workers'] = workers
+            tree_type = generic_mcts.TreeParallelMcTree
+        elif workers > 1:
+            options.update(workers=workers, tree_type=tree_type)
+            tree_type = generic_mcts.RootParallelMcTree
+        self.mct = tree_type(
             self.game,
-            select_policy=generic_mcts.UctSelectPolicy(),
+            select_policy=select_policy,
             playout_policy=playout_policy,
             number_of_playouts=number_of_playouts,
+            lazy_expansion=lazy_expansion,
+            time_limit=time_limit,
+            node_limit=node_limit,
+            **options
         )
 
     def status(self) -> Status:
@@ -148,24 +593,90 @@ class ChessMctsPlayer(generic_mcts.AiPlayer):
     def show(self):
         self.game.show(self.mct.root.game_state, colors=self.colors)
 
+    def memory_stats(self):
+        return self.mct.memory_stats()
+
+    def close(self):
+        if hasattr(self.mct, 'close'):
+            self.mct.close()
+
 
 class ChessAlphBetaPlayer(generic_mcts.AiPlayer):
-    def __init__(self, heuristic, search_depth=5, colors=False):
-        self.game = Game
+    def __init__(self, heuristic, search_depth=5, colors=False, tt_size_mb=0,
+                 time_limit=None, node_limit=None, move_ordering=False,
+                 quiescence=False, threads=1, pvs=False, aspiration=None,
+                 null_move=False, lmr=False, game=Game, batch_leaves=False):
+        self.game = game
         self.colors = colors
         self.board = self.game.initial_state()
         self.search_depth = search_depth
         self.heuristic = heuristic
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.threads = threads
+        self.tt_size_mb = tt_size_mb
+        self.smp = None
+        self.tt = None
+        if tt_size_mb and threads == 1:
+            self.tt = generic_alpha_beta.TranspositionTable(tt_size_mb)
+        self.ordering = None
+        if move_ordering:
+            self.ordering = ChessMoveOrdering()
+        self.quiescence = None
+        if quiescence:
+            self.quiescence = ChessQuiescence()
+        self.pvs = pvs
+        self.aspiration = aspiration
+        self.null_move = ChessNullMovePruning() if null_move else None
+        self.lmr = ChessLateMoveReductions() if lmr else None
+        self.batch_leaves = batch_leaves
+
+    def search_options(self):
+        return {
+            'time_limit': self.time_limit,
+            'node_limit': self.node_limit,
+            'ordering': self.ordering,
+            'quiescence': self.quiescence,
+            'pvs': self.pvs,
+            'aspiration': self.aspiration,
+            'null_move': self.null_move,
+            'lmr': self.lmr,
+            'batch_leaves': self.batch_leaves,
+        }
 
     def status(self) -> Status:
         return self.game.status(self.board)
 
     def choose_move(self) -> Move:
+        if self.ordering is not None:
+            self.ordering.clear()
+        if self.threads > 1:
+            if self.smp is None:
+                self.smp = generic_alpha_beta.LazySmp(
+                    self.threads, self.tt_size_mb or 16, encode_move, decode_move
+                )
+            return self.smp.choose_best_move(
+                self.game, self.board,
+                self.heuristic,
+                self.search_depth,
+                self.board.turn == chess.WHITE,
+                **self.search_options()
+            )
+        search = generic_alpha_beta.Search(tt=self.tt, **self.search_options())
+        if (self.time_limit is not None or self.node_limit is not None
+           or self.aspiration is not None):
+            return generic_alpha_beta.choose_best_move_iterative(
+                self.game, self.board,
+                self.heuristic,
+                self.search_depth,
+                self.board.turn == chess.WHITE,
+                search)
         return generic_alpha_beta.choose_best_move_minimax(
             self.game, self.board,
             self.heuristic,
             self.search_depth,
-            self.board.turn == chess.WHITE)
+            self.board.turn == chess.WHITE,
+            search)
 
     def apply_move(self, move: Move):
         self.game.apply_move(move, self.board)
@@ -173,6 +684,11 @@ class ChessAlphBetaPlayer(generic_mcts.AiPlayer):
     def show(self):
         self.game.show(self.board, colors=self.colors)
 
+    def close(self):
+        if self.smp is not None:
+            self.smp.close()
+            self.smp = None
+
 
 class ChessRandomPlayer(generic_mcts.AiPlayer):
     def __init__(self, colors=False):
@@ -195,6 +711,16 @@ class ChessRandomPlayer(generic_mcts.AiPlayer):
 
 
 
+PIECE_VAL = {
+    chess.PAWN: 10,
+    chess.KNIGHT: 30,
+    chess.BISHOP: 30,
+    chess.ROOK: 50,
+    chess.QUEEN: 90,
+    chess.KING: 900,
+}
+
+
 POSITION_BIAS = {
     chess.PAWN: [
         [ 0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0],
@@ -300,10 +826,295 @@ def score_board_with_pos_bias(board):
     return s
 
 
+def piece_square_table(piece_type, color):
+    """ Signed material + position bias of piece_type on each of the 64 squares """
+    table = []
+    for square in chess.SQUARES:
+        r, c = divmod(square, 8)
+        if color == chess.BLACK:
+            r, c = 7 - r, 7 - c
+        piece_score = PIECE_VAL[piece_type] + POSITION_BIAS[piece_type][r][c]
+        table.append(piece_score if color == chess.WHITE else -piece_score)
+    return table
+
+
+PIECE_SQUARE_SCORE = {
+    color: {piece_type: piece_square_table(piece_type, color)
+            for piece_type in POSITION_BIAS}
+    for color in chess.COLORS
+}
+
+
+def pos_bias_delta(board, move):
+    """ Change of the position-bias score when move is pushed on board """
+    if not move:
+        return 0
+    color = board.turn
+    table = PIECE_SQUARE_SCORE[color]
+    piece_type = board.piece_type_at(move.from_square)
+    delta = -table[piece_type][move.from_square]
+    if board.is_castling(move):
+        # standard chess only: the rook starts on the a or h file
+        rank = move.from_square & ~7
+        if board.is_kingside_castling(move):
+            king_to, rook_from, rook_to = rank + 6, rank + 7, rank + 5
+        else:
+            king_to, rook_from, rook_to = rank + 2, rank, rank + 3
+        rook = table[chess.ROOK]
+        return delta + table[chess.KING][king_to] - rook[rook_from] + rook[rook_to]
+    delta += table[move.promotion or piece_type][move.to_square]
+    if board.is_en_passant(move):
+        captured_square = move.to_square + (-8 if color == chess.WHITE else 8)
+        delta -= PIECE_SQUARE_SCORE[not color][chess.PAWN][captured_square]
+    else:
+        captured = board.piece_type_at(move.to_square)
+        if captured:
+            delta -= PIECE_SQUARE_SCORE[not color][captured][move.to_square]
+    return delta
+
+
+def score_board_bitboard(board, has_legal_moves=None):
+    """ score_board_with_pos_bias over the piece bitboards
+
+    A caller that already generated moves can pass has_legal_moves: True
+    skips the mate test and False only looks at whether the side to move
+    is in check.
+    """
+    if has_legal_moves is None:
+        mated = board.is_checkmate()
+    else:
+        mated = not has_legal_moves and board.is_check()
+    if mated:
+        if board.turn == chess.WHITE:
+            return -20000
+        else:
+            return 20000
+
+    s = 0
+    for color in chess.COLORS:
+        for piece_type, table in PIECE_SQUARE_SCORE[color].items():
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                s += table[square]
+    return s
+
+
+class IncrementalEvalBoard(chess.Board):
+    """ Board carrying its position-bias score, updated on every push/pop
+
+    Only push and pop keep the score current; call reset_eval after
+    editing the board any other way.
+    """
+
+    def __init__(self, fen=chess.STARTING_FEN, *, chess960=False):
+        super().__init__(fen, chess960=chess960)
+        self.reset_eval()
+
+    def reset_eval(self):
+        self.pos_bias_score = score_board_bitboard(self, has_legal_moves=True)
+        self.eval_stack = []
+
+    def push(self, move):
+        self.eval_stack.append(self.pos_bias_score)
+        self.pos_bias_score += pos_bias_delta(self, move)
+        super().push(move)
+
+    def pop(self):
+        move = super().pop()
+        self.pos_bias_score = self.eval_stack.pop()
+        return move
+
+    def copy(self, *, stack=True):
+        board = super().copy(stack=stack)
+        board.pos_bias_score = self.pos_bias_score
+        if stack:
+            stack = len(self.eval_stack) if stack is True else stack
+            board.eval_stack = self.eval_stack[-stack:]
+        return board
+
+
+class IncrementalEvalGame(Game):
+    @staticmethod
+    def initial_state():
+        return IncrementalEvalBoard()
+
+
+def score_board_incremental(board):
+    """ score_board_with_pos_bias for an IncrementalEvalBoard, without the scan """
+    if board.is_checkmate():
+        if board.turn == chess.WHITE:
+            return -20000
+        else:
+            return 20000
+    return board.pos_bias_score
+
+
 def score_board_stockfish(board):
-    info = stockfish.analyse(board, chess.engine.Limit(depth=1), info=chess.engine.INFO_SCORE)
-    score = info['score'].white().score(mate_score=10000)
-    return score
+    return stockfish.evaluate(board)
+
+
+def score_boards_stockfish(boards):
+    return stockfish.evaluate_many(boards)
+
+
+def stockfish_settings():
+    assert stockfish is not None, "load_stockfish() first"
+    return stockfish.settings()
+
+
+# batch protocol used by generic_alpha_beta when Search(batch_leaves=True);
+# static evaluators like score_board_with_pos_bias are cheaper one by one
+score_board_stockfish.evaluate_many = score_boards_stockfish
+score_board_stockfish.settings = stockfish_settings
+
+
+class EvalCache:
+    """ LRU cache of heuristic values, keyed by Zobrist hash
+
+    New values are also written in batches to an sqlite file when a path
+    is given, so later runs and other processes start warm. settings
+    names the heuristic and its configuration (engine, depth, ...); values
+    stored under different settings never mix. It defaults to
+    heuristic.settings() when the heuristic has one, else to its name.
+    """
+
+    def __init__(self, heuristic, settings=None, path=None, size=200000, batch=1000):
+        self.heuristic = heuristic
+        self.settings = settings or self.default_settings(heuristic)
+        self.path = path
+        self.size = size
+        self.batch = batch
+        self.memory = OrderedDict()
+        self.pending = []
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            self.open_db()
+
+    @staticmethod
+    def default_settings(heuristic):
+        if hasattr(heuristic, 'settings'):
+            return heuristic.settings()
+        return heuristic.__qualname__
+
+    def __getstate__(self):
+        return (self.heuristic, self.settings, self.path, self.size, self.batch)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def open_db(self):
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS settings ('
+                        'id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS evals ('
+                        'settings INTEGER, key INTEGER, score REAL, '
+                        'PRIMARY KEY (settings, key)) WITHOUT ROWID')
+        self.db.execute('INSERT OR IGNORE INTO settings (name) VALUES (?)',
+                        (self.settings,))
+        self.db.commit()
+        self.settings_id, = self.db.execute(
+            'SELECT id FROM settings WHERE name = ?', (self.settings,)).fetchone()
+
+    @staticmethod
+    def db_key(key):
+        # sqlite integers are signed 64 bit
+        return key - (1 << 64) if key >= 1 << 63 else key
+
+    def lookup(self, key):
+        # callers hold self.lock
+        score = self.memory.get(key)
+        if score is not None:
+            self.hits += 1
+            self.memory.move_to_end(key)
+            return score
+        if self.db is not None:
+            row = self.db.execute(
+                'SELECT score FROM evals WHERE settings = ? AND key = ?',
+                (self.settings_id, self.db_key(key))).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                self.remember(key, row[0])
+                return row[0]
+        return None
+
+    def add(self, key, score):
+        # callers hold self.lock
+        self.misses += 1
+        self.remember(key, score)
+        if self.db is not None:
+            self.pending.append((self.settings_id, self.db_key(key), score))
+            if len(self.pending) >= self.batch:
+                self.flush()
+
+    def __call__(self, board):
+        key = chess.polyglot.zobrist_hash(board)
+        with self.lock:
+            score = self.lookup(key)
+        if score is None:
+            score = self.heuristic(board)
+            with self.lock:
+                self.add(key, score)
+        return score
+
+    def evaluate_many(self, boards):
+        keys = [chess.polyglot.zobrist_hash(board) for board in boards]
+        with self.lock:
+            scores = [self.lookup(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if hasattr(self.heuristic, 'evaluate_many'):
+            values = self.heuristic.evaluate_many([boards[i] for i in missing])
+        else:
+            values = [self.heuristic(boards[i]) for i in missing]
+        with self.lock:
+            for i, score in zip(missing, values):
+                self.add(keys[i], score)
+                scores[i] = score
+        return scores
+
+    def remember(self, key, score):
+        self.memory[key] = score
+        if len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def flush(self):
+        with self.lock:
+            if self.db is None or not self.pending:
+                return
+            self.db.executemany('INSERT OR IGNORE INTO evals VALUES (?, ?, ?)', self.pending)
+            self.db.commit()
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def hit_ratio(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0
+
+    def memory_bytes(self):
+        # dict itself plus one boxed key and value per entry
+        entry = sys.getsizeof(1 << 63) + sys.getsizeof(0.5)
+        return sys.getsizeof(self.memory) + len(self.memory) * entry
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio(),
+            'entries': len(self.memory),
+            'memory_bytes': self.memory_bytes(),
+        }
+        if self.path is not None and os.path.exists(self.path):
+            stats['disk_bytes'] = os.path.getsize(self.path)
+        return stats
 
 
 def play_against_computer(method, **kwargs):
@@ -316,7 +1127,8 @@ def play_against_computer(method, **kwargs):
             game,
             select_policy=kwargs['select_policy'],
             playout_policy=kwargs['playout_policy'],
-            number_of_playouts=kwargs['number_of_playouts'],
+            number_of_playouts=kwargs.get('number_of_playouts'),
+            time_limit=kwargs.get('time_limit'),
         )
 
         while True:
@@ -341,16 +1153,25 @@ def play_against_computer(method, **kwargs):
                 game.apply_move(move, board)
                 game.show(board)
                 print("thinking...")
-                ai_move = generic_alpha_beta.choose_best_move_minimax(
-                    game, board,
-                    kwargs['heuristics'],
-                    kwargs['depth'],
-                    False
-                )
+                if kwargs.get('time_limit') is not None:
+                    ai_move = generic_alpha_beta.choose_best_move_iterative(
+                        game, board,
+                        kwargs['heuristics'],
+                        kwargs['depth'],
+                        False,
+                        generic_alpha_beta.Search(time_limit=kwargs['time_limit'])
+                    )
+                else:
+                    ai_move = generic_alpha_beta.choose_best_move_minimax(
+                        game, board,
+                        kwargs['heuristics'],
+                        kwargs['depth'],
+                        False
+                    )
                 game.apply_move(ai_move, board)
                 print()
         finally:
-            stockfish.quit()
+            close_stockfish()
 
 
 if __name__ == '__main__':
@@ -360,4 +1181,8 @@ if __name__ == '__main__':
     play_against_computer('mcts', select_policy=generic_mcts.UctSelectPolicy(),
                           playout_policy=UniformRandomPlayoutPolicy(),
                           number_of_playouts=200)
+
+    play_against_computer('mcts', select_policy=generic_mcts.UctSelectPolicy(),
+                          playout_policy=UniformRandomPlayoutPolicy(),
+                          time_limit=5)
     """
@@ -1,48 +1,614 @@
 import math
+import time
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
 from random import choice
+from collections import namedtuple
 
 
-def minimax(game, game_state, heuristic, depth, alpha, beta, is_maxing_player):
-    if depth == 1:
-        return heuristic(game_state)
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+TtEntry = namedtuple('TtEntry', 'key depth flag value move')
+
+
+class TranspositionTable:
+    # rough cost of one slot: list pointer + TtEntry tuple + boxed key/value
+    ENTRY_SIZE = 128
+
+    def __init__(self, size_mb=16):
+        self.size = max(1, int(size_mb * 1024 * 1024) // self.ENTRY_SIZE)
+        self.entries = [None] * self.size
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key % self.size]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, flag, value, move=None):
+        i = key % self.size
+        old = self.entries[i]
+        if old is not None:
+            # depth-preferred: never replace a deeper search of another position
+            if old.key != key and old.depth > depth:
+                return
+            if old.key != key:
+                self.overwrites += 1
+            elif move is None:
+                move = old.move
+        self.stores += 1
+        self.entries[i] = TtEntry(key, depth, flag, value, move)
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0
+
+    def cutoff_rate(self):
+        return self.cutoffs / self.probes if self.probes else 0
+
+    def stats(self):
+        used = sum(1 for e in self.entries if e is not None)
+        return {
+            'probes': self.probes,
+            'hits': self.hits,
+            'cutoffs': self.cutoffs,
+            'hit_rate': self.hit_rate(),
+            'cutoff_rate': self.cutoff_rate(),
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'fill': used / self.size,
+        }
+
+
+class SharedTranspositionTable:
+    """ Lockless table in shared memory, usable from several processes
+
+    Every slot holds key ^ value ^ meta next to value and meta, so a slot
+    torn by two processes writing at once reads back as a miss.
+    Moves are only kept when encode_move/decode_move map them to
+    non-negative ints; both must be picklable.
+    """
+
+    HEADER = struct.Struct('<Q')
+    SLOT = struct.Struct('<QQQ')
+    FLOAT = struct.Struct('<d')
+    UINT = struct.Struct('<Q')
+
+    def __init__(self, size_mb=16, encode_move=None, decode_move=None):
+        self.size = max(1, int(size_mb * 1024 * 1024) // self.SLOT.size)
+        self.encode_move = encode_move
+        self.decode_move = decode_move
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.HEADER.size + self.size * self.SLOT.size
+        )
+        self.shm.buf[:] = bytes(self.shm.size)
+        self.owner = True
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def __getstate__(self):
+        return (self.shm.name, self.size, self.encode_move, self.decode_move)
+
+    def __setstate__(self, state):
+        name, self.size, self.encode_move, self.decode_move = state
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = False
+        self._reset_counters()
+
+    def _float_bits(self, value):
+        return self.UINT.unpack(self.FLOAT.pack(value))[0]
+
+    def _read(self, i):
+        check, value_bits, meta = self.SLOT.unpack_from(
+            self.shm.buf, self.HEADER.size + i * self.SLOT.size
+        )
+        if meta == 0:
+            return None
+        return check ^ value_bits ^ meta, value_bits, meta
+
+    def probe(self, key):
+        self.probes += 1
+        slot = self._read(key % self.size)
+        if slot is None or slot[0] != key:
+            return None
+        self.hits += 1
+        _, value_bits, meta = slot
+        move = None
+        if meta >> 18 and self.decode_move is not None:
+            move = self.decode_move((meta >> 18) - 1)
+        value = self.FLOAT.unpack(self.UINT.pack(value_bits))[0]
+        return TtEntry(key, meta & 0xffff, (meta >> 16) & 3, value, move)
+
+    def store(self, key, depth, flag, value, move=None):
+        i = key % self.size
+        old = self._read(i)
+        move_code = 0
+        if move is not None and self.encode_move is not None:
+            move_code = self.encode_move(move) + 1
+        if old is not None:
+            old_key, _, old_meta = old
+            if old_key != key and old_meta & 0xffff > depth:
+                return
+            if old_key != key:
+                self.overwrites += 1
+            elif move_code == 0:
+                move_code = old_meta >> 18
+        self.stores += 1
+        value_bits = self._float_bits(value)
+        meta = depth | flag << 16 | move_code << 18
+        self.SLOT.pack_into(
+            self.shm.buf, self.HEADER.size + i * self.SLOT.size,
+            key ^ value_bits ^ meta, value_bits, meta
+        )
+
+    def stopped(self):
+        return self.shm.buf[0] != 0
+
+    def set_stopped(self, stopped):
+        self.shm.buf[0] = 1 if stopped else 0
+
+    def clear(self):
+        self.shm.buf[self.HEADER.size:] = bytes(self.size * self.SLOT.size)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0
+
+    def cutoff_rate(self):
+        return self.cutoffs / self.probes if self.probes else 0
+
+    def stats(self):
+        # counters are per process; fill is sampled from the start of the table
+        sample = min(self.size, 65536)
+        used = sum(1 for i in range(sample) if self._read(i) is not None)
+        return {
+            'probes': self.probes,
+            'hits': self.hits,
+            'cutoffs': self.cutoffs,
+            'hit_rate': self.hit_rate(),
+            'cutoff_rate': self.cutoff_rate(),
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'fill': used / sample,
+        }
+
+
+class MoveOrdering:
+    """ Hash move first, then game-specific good moves, killers and history """
+
+    def __init__(self, killers_per_ply=2):
+        self.killers_per_ply = killers_per_ply
+        self.killers = {}
+        self.history = {}
+
+    def score_move(self, game, game_state, move):
+        # games override this to rank captures, promotions etc. above quiet moves
+        return 0
+
+    def is_quiet(self, game, game_state, move):
+        return self.score_move(game, game_state, move) <= 0
+
+    def order(self, game, game_state, moves, ply, hash_move=None):
+        killers = self.killers.get(ply, [])
+
+        def key(move):
+            if hash_move is not None and move == hash_move:
+                return (3, 0)
+            score = self.score_move(game, game_state, move)
+            if score > 0:
+                return (2, score)
+            if move in killers:
+                return (1, -killers.index(move))
+            return (0, self.history.get(move, 0))
+        return sorted(moves, key=key, reverse=True)
+
+    def cutoff(self, game, game_state, move, depth, ply):
+        if not self.is_quiet(game, game_state, move):
+            return
+        killers = self.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.killers_per_ply:]
+        self.history[move] = self.history.get(move, 0) + depth * depth
+
+    def clear(self):
+        self.killers = {}
+        self.history = {}
+
+
+class Quiescence:
+    """ Which moves to keep searching past the horizon, and what they can gain """
+
+    def __init__(self, delta_margin=None):
+        self.delta_margin = delta_margin
+
+    def noisy_moves(self, game, game_state):
+        return []
+
+    def gain(self, game, game_state, move):
+        # upper bound on how much move can change the evaluation, for delta pruning
+        return math.inf
+
+
+class NullMovePruning:
+    """ Passing the turn, and when a game allows it without zugzwang risk """
+
+    def __init__(self, reduction=2):
+        self.reduction = reduction
+
+    def allowed(self, game, game_state):
+        assert False, "unimplemented"
+
+    def apply(self, game, game_state):
+        assert False, "unimplemented"
+
+    def undo(self, game, game_state):
+        assert False, "unimplemented"
+
+
+class LateMoveReductions:
+    """ Moves after the first full_moves of a node are searched shallower """
+
+    def __init__(self, full_moves=3, reduction=1):
+        self.full_moves = full_moves
+        self.reduction = reduction
+
+    def can_reduce(self, game, game_state, move):
+        # games override this to keep tactical moves at full depth
+        return True
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Search:
+    """ Options and counters shared by one alpha-beta search """
+
+    def __init__(self, tt=None, time_limit=None, node_limit=None, ordering=None,
+                 quiescence=None, stop=None, pvs=False, aspiration=None,
+                 null_move=None, lmr=None, batch_leaves=False):
+        self.tt = tt
+        self.batch_leaves = batch_leaves
+        self.null_move = null_move
+        self.lmr = lmr
+        self.stop = stop
+        self.pvs = pvs
+        self.aspiration = aspiration
+        self.ordering = ordering
+        self.quiescence = quiescence
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.deadline = None
+        self.completed_depth = 0
+        self.nodes = 0
+        self.qnodes = 0
+        self.max_ply = 0
+        self.researches = 0
+        self.aspiration_fails = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.lmr_researches = 0
+        self.batches = 0
+        self.batched_leaves = 0
+
+    def start(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.max_ply = 0
+        self.researches = 0
+        self.aspiration_fails = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.lmr_researches = 0
+        self.batches = 0
+        self.batched_leaves = 0
+        self.completed_depth = 0
+        self.deadline = None
+        if self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+
+    def check_budget(self):
+        if self.stop is not None and self.stop.stopped():
+            raise SearchTimeout()
+        # the first iteration always runs to completion so there is a move to return
+        if not self.completed_depth:
+            return
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise SearchTimeout()
+
+
+def quiescence(game, game_state, heuristic, alpha, beta, is_maxing_player, search, ply):
+    search.qnodes += 1
+    search.max_ply = max(search.max_ply, ply)
+    search.check_budget()
+
+    stand_pat = heuristic(game_state)
+    q = search.quiescence
+    moves = [(q.gain(game, game_state, move), move)
+             for move in q.noisy_moves(game, game_state)]
+    moves.sort(key=lambda gm: gm[0], reverse=True)
 
     if is_maxing_player:
-        best_move = -math.inf
-        for move in game.possible_moves(game_state):
+        if stand_pat >= beta:
+            return stand_pat
+        best_move = stand_pat
+        alpha = max(alpha, stand_pat)
+        for gain, move in moves:
+            if (q.delta_margin is not None
+               and stand_pat + gain + q.delta_margin <= alpha):
+                break
             game.apply_move(move, game_state)
-            best_move = max(
-                best_move,
-                minimax(
-                    game, game_state, heuristic,
-                    depth - 1, alpha, beta,
-                    not is_maxing_player
-                )
+            child_score = quiescence(
+                game, game_state, heuristic, alpha, beta,
+                not is_maxing_player, search, ply + 1
             )
             game.undo_move(move, game_state)
+            best_move = max(best_move, child_score)
             alpha = max(alpha, best_move)
             if beta <= alpha:
-                return best_move
-        return best_move
+                break
     else:
-        best_move = math.inf
-        for move in game.possible_moves(game_state):
+        if stand_pat <= alpha:
+            return stand_pat
+        best_move = stand_pat
+        beta = min(beta, stand_pat)
+        for gain, move in moves:
+            if (q.delta_margin is not None
+               and stand_pat - gain - q.delta_margin >= beta):
+                break
             game.apply_move(move, game_state)
-            best_move = min(
-                best_move,
-                minimax(
-                    game, game_state, heuristic,
-                    depth - 1, alpha, beta,
-                    not is_maxing_player
-                )
+            child_score = quiescence(
+                game, game_state, heuristic, alpha, beta,
+                not is_maxing_player, search, ply + 1
             )
             game.undo_move(move, game_state)
+            best_move = min(best_move, child_score)
             beta = min(beta, best_move)
             if beta <= alpha:
-                return best_move
-        return best_move
+                break
+    return best_move
+
+
+def can_batch_leaves(heuristic, search):
+    # quiescence leaves are searches of their own, not static evaluations
+    return (search.batch_leaves and search.quiescence is None
+            and hasattr(heuristic, 'evaluate_many'))
+
+
+def evaluate_children(game, game_state, heuristic, moves, search):
+    """ Scores every move's position with one heuristic.evaluate_many call
+
+    All siblings are evaluated, even those alpha-beta will prune; the
+    search then walks the returned scores exactly as it would have walked
+    the single evaluations, so values and cutoffs do not change. Each
+    sibling also costs a full game_state.copy() (a chess board copies its
+    move stack), so this only pays off when one evaluate_many call is
+    much cheaper than as many single evaluations.
+    """
+    search.check_budget()
+    states = []
+    for move in moves:
+        game.apply_move(move, game_state)
+        states.append(game_state.copy())
+        game.undo_move(move, game_state)
+    search.batches += 1
+    search.batched_leaves += len(states)
+    return heuristic.evaluate_many(states)
 
 
-def choose_best_move_minimax(game, game_state, heuristic, search_depth, is_maxing_player):
+def search_child(game, game_state, heuristic, depth, alpha, beta, is_maxing_player,
+                 search, ply, reduction=0, null_window=False):
+    """ Scores the position after a move from a node at depth
+
+    A reduced or null-window search only tells whether the move beats the
+    side to move's bound; only a move that does is searched again in full.
+    """
+    if is_maxing_player:
+        low, high = alpha, math.nextafter(alpha, math.inf)
+    else:
+        low, high = math.nextafter(beta, -math.inf), beta
+
+    if reduction:
+        search.reductions += 1
+        score = minimax(
+            game, game_state, heuristic, depth - 1 - reduction,
+            low, high, not is_maxing_player, search, ply + 1
+        )
+        if (score <= alpha) if is_maxing_player else (score >= beta):
+            return score
+        search.lmr_researches += 1
+    if null_window:
+        score = minimax(
+            game, game_state, heuristic, depth - 1,
+            low, high, not is_maxing_player, search, ply + 1
+        )
+        if not alpha < score < beta:
+            return score
+        search.researches += 1
+    return minimax(
+        game, game_state, heuristic, depth - 1,
+        alpha, beta, not is_maxing_player, search, ply + 1
+    )
+
+
+def minimax(game, game_state, heuristic, depth, alpha, beta, is_maxing_player,
+            search=None, ply=1):
+    if search is None:
+        search = Search()
+    search.nodes += 1
+    search.check_budget()
+
+    if depth == 1:
+        if search.quiescence is not None:
+            return quiescence(
+                game, game_state, heuristic, alpha, beta,
+                is_maxing_player, search, ply
+            )
+        return heuristic(game_state)
+
+    tt = search.tt
+    hash_move = None
+    if tt is not None:
+        key = game.hash_state(game_state)
+        entry = tt.probe(key)
+        if entry is not None:
+            hash_move = entry.move
+        if entry is not None and entry.depth >= depth:
+            if entry.flag == EXACT:
+                tt.cutoffs += 1
+                return entry.value
+            elif entry.flag == LOWER_BOUND:
+                alpha = max(alpha, entry.value)
+            else:
+                beta = min(beta, entry.value)
+            if beta <= alpha:
+                tt.cutoffs += 1
+                return entry.value
+        original_alpha, original_beta = alpha, beta
+
+    null_move = search.null_move
+    if (null_move is not None and depth - 1 - null_move.reduction >= 1
+       and null_move.allowed(game, game_state)):
+        # let the opponent move twice; if we still fail high the node is cut
+        if is_maxing_player and beta < math.inf:
+            null_move.apply(game, game_state)
+            score = minimax(
+                game, game_state, heuristic,
+                depth - 1 - null_move.reduction,
+                math.nextafter(beta, -math.inf), beta,
+                not is_maxing_player, search, ply + 1
+            )
+            null_move.undo(game, game_state)
+            if score >= beta:
+                search.null_cutoffs += 1
+                return score
+        elif not is_maxing_player and alpha > -math.inf:
+            null_move.apply(game, game_state)
+            score = minimax(
+                game, game_state, heuristic,
+                depth - 1 - null_move.reduction,
+                alpha, math.nextafter(alpha, math.inf),
+                not is_maxing_player, search, ply + 1
+            )
+            null_move.undo(game, game_state)
+            if score <= alpha:
+                search.null_cutoffs += 1
+                return score
+
+    moves = game.possible_moves(game_state)
+    ordering = search.ordering
+    if ordering is not None:
+        moves = ordering.order(game, game_state, moves, ply, hash_move)
+
+    leaf_scores = None
+    if depth == 2 and can_batch_leaves(heuristic, search):
+        leaf_scores = evaluate_children(game, game_state, heuristic, moves, search)
+
+    best_action = None
+    lmr = search.lmr
+    if is_maxing_player:
+        best_move = -math.inf
+        for i, move in enumerate(moves):
+            if leaf_scores is not None:
+                search.nodes += 1
+                child_score = leaf_scores[i]
+            else:
+                reduction = 0
+                if (lmr is not None and i >= lmr.full_moves
+                   and depth - 1 - lmr.reduction >= 1
+                   and lmr.can_reduce(game, game_state, move)):
+                    reduction = lmr.reduction
+                game.apply_move(move, game_state)
+                child_score = search_child(
+                    game, game_state, heuristic, depth, alpha, beta,
+                    is_maxing_player, search, ply, reduction,
+                    search.pvs and best_action is not None
+                )
+                game.undo_move(move, game_state)
+            if child_score > best_move or best_action is None:
+                best_action = move
+            best_move = max(best_move, child_score)
+            alpha = max(alpha, best_move)
+            if beta <= alpha:
+                if ordering is not None:
+                    ordering.cutoff(game, game_state, move, depth, ply)
+                break
+    else:
+        best_move = math.inf
+        for i, move in enumerate(moves):
+            if leaf_scores is not None:
+                search.nodes += 1
+                child_score = leaf_scores[i]
+            else:
+                reduction = 0
+                if (lmr is not None and i >= lmr.full_moves
+                   and depth - 1 - lmr.reduction >= 1
+                   and lmr.can_reduce(game, game_state, move)):
+                    reduction = lmr.reduction
+                game.apply_move(move, game_state)
+                child_score = search_child(
+                    game, game_state, heuristic, depth, alpha, beta,
+                    is_maxing_player, search, ply, reduction,
+                    search.pvs and best_action is not None
+                )
+                game.undo_move(move, game_state)
+            if child_score < best_move or best_action is None:
+                best_action = move
+            best_move = min(best_move, child_score)
+            beta = min(beta, best_move)
+            if beta <= alpha:
+                if ordering is not None:
+                    ordering.cutoff(game, game_state, move, depth, ply)
+                break
+
+    if tt is not None:
+        if best_move <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_move >= original_beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        tt.store(key, depth, flag, best_move, best_action)
+    return best_move
+
+
+def search_root(game, game_state, heuristic, search_depth, is_maxing_player, search,
+                alpha=-math.inf, beta=math.inf):
+    """ Returns the root moves sharing the best score, and that score
+
+    Ties are broken at random by the caller, so every move that reaches the
+    best score needs its exact value. With PVS a null window only asks
+    whether a move reaches the best score so far; any move that does is
+    searched again with the full window.
+    """
     best_moves = []
     if is_maxing_player:
         f = max
@@ -50,17 +616,169 @@ def choose_best_move_minimax(game, game_state, heuristic, search_depth, is_maxin
     else:
         f = min
         best_score = math.inf
-    for move in game.possible_moves(game_state):
-        game.apply_move(move, game_state)
-        child_score = minimax(
-            game, game_state, heuristic, search_depth,
-            -math.inf, math.inf, not is_maxing_player
-        )
-        game.undo_move(move, game_state)
+    moves = game.possible_moves(game_state)
+    leaf_scores = None
+    if search_depth == 1 and can_batch_leaves(heuristic, search):
+        leaf_scores = evaluate_children(game, game_state, heuristic, moves, search)
+    for i, move in enumerate(moves):
+        if leaf_scores is not None:
+            search.nodes += 1
+            child_score = leaf_scores[i]
+        else:
+            game.apply_move(move, game_state)
+            if search.pvs and best_moves and math.isfinite(best_score):
+                if is_maxing_player:
+                    low = math.nextafter(best_score, -math.inf)
+                    child_score = minimax(
+                        game, game_state, heuristic, search_depth,
+                        low, best_score, not is_maxing_player, search
+                    )
+                    if child_score > low:
+                        search.researches += 1
+                        child_score = minimax(
+                            game, game_state, heuristic, search_depth,
+                            max(alpha, low), beta, not is_maxing_player, search
+                        )
+                else:
+                    high = math.nextafter(best_score, math.inf)
+                    child_score = minimax(
+                        game, game_state, heuristic, search_depth,
+                        best_score, high, not is_maxing_player, search
+                    )
+                    if child_score < high:
+                        search.researches += 1
+                        child_score = minimax(
+                            game, game_state, heuristic, search_depth,
+                            alpha, min(beta, high), not is_maxing_player, search
+                        )
+            else:
+                child_score = minimax(
+                    game, game_state, heuristic, search_depth,
+                    alpha, beta, not is_maxing_player, search
+                )
+            game.undo_move(move, game_state)
         if f(child_score, best_score) == child_score:
             if child_score == best_score:
                 best_moves.append(move)
             else:
                 best_moves = [move]
             best_score = child_score
+    return best_moves, best_score
+
+
+def choose_best_move_minimax(game, game_state, heuristic, search_depth, is_maxing_player,
+                             search=None):
+    if search is None:
+        search = Search()
+    best_moves, _ = search_root(
+        game, game_state, heuristic, search_depth, is_maxing_player, search
+    )
     return choice(best_moves)
+
+
+def choose_best_move_iterative(game, game_state, heuristic, max_depth, is_maxing_player,
+                               search, start_depth=1):
+    """ Deepen until max_depth or the search budget runs out """
+    search.start()
+    # an interrupted iteration leaves moves applied, so work on a copy
+    game_state = game_state.copy()
+    best_move = None
+    score = None
+    for depth in range(start_depth, max_depth + 1):
+        alpha, beta = -math.inf, math.inf
+        if search.aspiration is not None and score is not None and math.isfinite(score):
+            alpha = score - search.aspiration
+            beta = score + search.aspiration
+        try:
+            while True:
+                best_moves, score = search_root(
+                    game, game_state, heuristic, depth, is_maxing_player,
+                    search, alpha, beta
+                )
+                # on a fail the window is opened on that side and the depth redone
+                if alpha > -math.inf and score <= alpha:
+                    alpha = -math.inf
+                elif beta < math.inf and score >= beta:
+                    beta = math.inf
+                else:
+                    break
+                search.aspiration_fails += 1
+        except SearchTimeout:
+            break
+        best_move = choice(best_moves)
+        search.completed_depth = depth
+    return best_move
+
+
+_worker_tt = None
+
+
+def _init_smp_worker(tt):
+    global _worker_tt
+    _worker_tt = tt
+
+
+def _smp_helper_search(game, game_state, heuristic, max_depth, is_maxing_player,
+                       options, start_depth):
+    search = Search(tt=_worker_tt, stop=_worker_tt, **options)
+    move = choose_best_move_iterative(
+        game, game_state, heuristic, max_depth, is_maxing_player,
+        search, start_depth
+    )
+    return search.completed_depth, move, search.nodes
+
+
+class LazySmp:
+    """ Parallel search: helpers iterate on the same root, sharing one table
+
+    Half of the helpers start one ply deeper than the main search so they
+    fill the table ahead of it. The main search runs in this process. When
+    it finishes, the helpers are stopped through a flag in the shared
+    table. The move from the deepest completed iteration is played.
+    Helpers run in forked processes, so the heuristic must not depend on
+    per-process resources such as the global stockfish engine.
+    """
+
+    def __init__(self, threads, tt_size_mb=16, encode_move=None, decode_move=None):
+        self.threads = threads
+        self.tt = SharedTranspositionTable(tt_size_mb, encode_move, decode_move)
+        self.pool = None
+        if threads > 1:
+            self.pool = multiprocessing.Pool(
+                threads - 1, initializer=_init_smp_worker, initargs=(self.tt,)
+            )
+        self.nodes = 0
+
+    def choose_best_move(self, game, game_state, heuristic, max_depth, is_maxing_player,
+                         **options):
+        self.tt.set_stopped(False)
+        helpers = []
+        for i in range(1, self.threads):
+            helpers.append(self.pool.apply_async(
+                _smp_helper_search,
+                (game, game_state, heuristic, max_depth, is_maxing_player,
+                 options, 1 + i % 2)
+            ))
+        search = Search(tt=self.tt, **options)
+        best_move = choose_best_move_iterative(
+            game, game_state, heuristic, max_depth, is_maxing_player, search
+        )
+        best_depth = search.completed_depth
+        self.tt.set_stopped(True)
+        self.nodes = search.nodes
+        for helper in helpers:
+            depth, move, nodes = helper.get()
+            self.nodes += nodes
+            if depth > best_depth and move is not None:
+                best_depth, best_move = depth, move
+        return best_move
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.tt.close()
+
+    def __del__(self):
+        self.close()
@@ -1,4 +1,9 @@
 import math
+import time
+import random
+import multiprocessing
+import weakref
+import concurrent.futures
 from random import choice
 
 
@@ -17,6 +22,8 @@ class GameState:
 
 
 class Game:
+    max_score = 1  # upper bound of score()
+
     @staticmethod
     def status(game_state):
         assert False, "unimplemented"
@@ -37,6 +44,10 @@ class Game:
     def possible_moves(game_state):
         assert False, "unimplemented"
 
+    @staticmethod
+    def hash_state(game_state):
+        assert False, "unimplemented"
+
     @staticmethod
     def initial_state():
         assert False, "unimplemented"
@@ -62,29 +73,45 @@ class AiPlayer:
 
 class UctSelectPolicy:
     @staticmethod
-    def uct(node):
+    def uct(node, t=None):
         if node.playout_count == 0:
             return 10000  # return high value
         w = node.win_count
         n = node.playout_count
-        t = node.parent.playout_count
+        if t is None:
+            t = node.parent.playout_count
         return w / n + math.sqrt(2 * math.log(t) / n)
 
-    def select(self, node):
+    @staticmethod
+    def unsolved(children):
+        """ The children MCTS-Solver has not proven yet, or all of them """
+        return [c for c in children if c.proven is None] or children
+
+    def select(self, node, path=None):
+        if path is not None:
+            path.append(node)
         while node.children:
-            node = max(node.children, key=lambda n: UctSelectPolicy.uct(n))
+            t = node.playout_count
+            node = max(self.unsolved(node.children), key=lambda n: UctSelectPolicy.uct(n, t))
+            if path is not None:
+                path.append(node)
         return node
 
 
 class McTreeNode:
 
-    def __init__(self, game_state, move=None, parent=None):
+    def __init__(self, game_state, move=None, parent=None, depth=0):
         self.win_count = 0
         self.playout_count = 0
         self.game_state = game_state
         self.move = move
         self.parent = parent
+        self.depth = depth
         self.children = []
+        self.child_moves = []
+        # result of the game under best play, once MCTS-Solver proves it
+        self.proven = None
+        self.proven_score = None
 
     def random_child(self):
         return choice(self.children)
@@ -95,56 +122,577 @@ class McTreeNode:
         if self.parent:
             self.parent.add_playout(result, score)
 
+    def backpropagate(self, result, score, path=None):
+        """ add_playout without recursion
+
+        Players alternate, so only this node and its parent are scored and
+        the two values alternate up the path. path is the root to this node
+        list kept by selection; without it the parent links are followed.
+        """
+        nodes = reversed(path) if path else self.ancestors()
+        scores = []
+        for depth, node in enumerate(nodes):
+            if depth < 2:
+                scores.append(score(result, node.game_state))
+            node.playout_count += 1
+            node.win_count += scores[depth % 2]
+
+    def ancestors(self):
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
     def get_weight(self):
+        if self.proven_score is not None:
+            return self.proven_score
         if self.playout_count == 0:
             return 0
         return self.win_count / self.playout_count
 
-    def expand(self, game):
+    def prove(self, result, score):
+        self.proven = result
+        self.proven_score = score(result, self.game_state)
+
+    def minimax_result(self, max_score):
+        """ The proven result of this node's best move for the player to
+        move here, None while that is not known yet """
+        best = None
+        for child in self.children:
+            if child.proven is None:
+                continue
+            if child.proven_score >= max_score:
+                return child.proven
+            if best is None or child.proven_score > best.proven_score:
+                best = child
+        if best is None or any(c.proven is None for c in self.children):
+            return None
+        return best.proven
+
+    def expand(self, game, lazy=False, transpositions=None):
+        """ Adds a child per move and returns how many nodes were created
+
+        With a transpositions table, keyed by (hash_state, depth), a
+        position already in it is linked instead of created again. Its
+        parent and move stay those of the node that created it.
+        """
         assert self.children == []
+        created = 0
         for move in game.possible_moves(self.game_state):
-            game_state = self.game_state.copy()
-            game.apply_move(move, game_state)
-            node = McTreeNode(game_state, move, parent=self)
+            node = None
+            if transpositions is not None:
+                game.apply_move(move, self.game_state)
+                key = (game.hash_state(self.game_state), self.depth + 1)
+                node = transpositions.get(key)
+                if node is None and not lazy:
+                    game_state = self.game_state.copy()
+                game.undo_move(move, self.game_state)
+            elif not lazy:
+                game_state = self.game_state.copy()
+                game.apply_move(move, game_state)
+            if node is None:
+                node = McTreeNode(None if lazy else game_state, move,
+                                  parent=self, depth=self.depth + 1)
+                if transpositions is not None:
+                    transpositions[key] = node
+                created += 1
             self.children.append(node)
+            self.child_moves.append(move)
+        return created
+
+    def materialize(self, game):
+        """ Builds the state of a lazily expanded node from its parent """
+        if self.game_state is None:
+            self.game_state = self.parent.game_state.copy()
+            game.apply_move(self.move, self.game_state)
+        return self.game_state
 
     def get_best_child(self):
         best_weight = max(c.get_weight() for c in self.children)
         return choice([c for c in self.children
                        if c.get_weight() == best_weight])
 
+    def get_best_move(self):
+        return self.child_moves[self.children.index(self.get_best_child())]
+
+    def collapse(self, keep=()):
+        """ Turns this node back into a leaf, keeping its statistics
+
+        The children lists below are cleared too, which breaks the
+        parent/child cycles so the subtree is freed without waiting for
+        the cyclic gc. Nodes whose id is in keep are left alone. Returns
+        how many nodes were dropped.
+        """
+        stack = self.children
+        self.children = []
+        self.child_moves = []
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if id(node) in seen or id(node) in keep:
+                continue
+            seen.add(id(node))
+            stack.extend(node.children)
+            node.children = []
+            node.child_moves = []
+        return len(seen)
 
-class McTree:
 
-    def __init__(self, game, select_policy, playout_policy, number_of_playouts):
+class McTree:
+    """ Monte carlo tree search
+
+    A search runs number_of_playouts playouts, or until time_limit seconds
+    pass or node_limit nodes have been added, whichever comes first; any of
+    them may be None. It also stops once the best root child can not be
+    overtaken by the playouts the budget has left.
+
+    With max_nodes, a tree that outgrows it has its least visited subtrees
+    collapsed until it is back under evict_to of the budget.
+
+    With solver, MCTS-Solver runs alongside: a finished game is a proven
+    result, and a node is proven once one move wins for the player to
+    move there or all of its moves are proven. Selection skips proven
+    nodes and the search stops when the root is proven.
+
+    With batch_size > 1, that many leaves are selected at once, spread by
+    a virtual loss each, and handed together to the playout policy's
+    playout_many(nodes), which returns a result per node.
+    """
+
+    def __init__(self, game, select_policy, playout_policy, number_of_playouts,
+                 lazy_expansion=False, time_limit=None, node_limit=None,
+                 transpositions=False, max_nodes=None, evict_to=0.9,
+                 batch_size=1, solver=False):
+        assert number_of_playouts or time_limit or node_limit, "no search budget"
         self.game = game
         self.select_policy = select_policy
         self.playout_policy = playout_policy
         self.number_of_playouts = number_of_playouts
-        self.root = McTreeNode(game.initial_state())
+        self.lazy_expansion = lazy_expansion
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.transpositions = weakref.WeakValueDictionary() if transpositions else None
+        self.transposition_hits = 0
+        self.max_nodes = max_nodes
+        self.evict_to = evict_to
+        self.batch_size = batch_size
+        self.solver = solver
+        self.reset(game.initial_state())
+        self.playouts = 0
+        self.nodes = 0
+        self.stopped_early = False
+        self.evictions = 0
+        self.evicted_nodes = 0
+        self.reclaimed_nodes = 0
+
+    def reset(self, game_state):
+        """ Starts over with a tree holding only game_state """
+        self.root = McTreeNode(game_state)
+        self.size = 1
 
     def apply_move(self, move):
-        for child in self.root.children:
-            if child.move == move:
+        old_root = self.root
+        for child, child_move in zip(old_root.children, old_root.child_moves):
+            if child_move == move:
+                child.materialize(self.game)
                 self.root = child
                 self.root.parent = None
-                return
-        game_state = self.root.game_state.copy()
-        self.game.apply_move(move, game_state)
-        self.root = McTreeNode(game_state, move)
+                self.root.move = move
+                break
+        else:
+            game_state = old_root.game_state.copy()
+            self.game.apply_move(move, game_state)
+            self.root = McTreeNode(game_state, move, depth=old_root.depth + 1)
+        self.reclaim(old_root)
+
+    def reclaim(self, old_root):
+        """ Frees what apply_move left behind: the old root and siblings """
+        keep = self.reachable() if self.transpositions is not None else {id(self.root)}
+        self.reclaimed_nodes += 1 + old_root.collapse(keep)
+        self.size = len(keep) if self.transpositions is not None else self.count_nodes()
+
+    def reachable(self):
+        seen = {id(self.root)}
+        stack = [self.root]
+        while stack:
+            for child in stack.pop().children:
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+        return seen
+
+    def count_nodes(self):
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    def enforce_budget(self):
+        if self.max_nodes is not None and self.size > self.max_nodes:
+            self.evict()
+
+    def evict(self):
+        """ Collapses the least visited subtrees below the root to leaves """
+        candidates = []
+        stack = [self.root]
+        seen = set()
+        while stack:
+            for child in stack.pop().children:
+                if child.children and id(child) not in seen:
+                    seen.add(id(child))
+                    candidates.append(child)
+                    stack.append(child)
+        candidates.sort(key=lambda node: node.playout_count)
+        target = int(self.max_nodes * self.evict_to)
+        for node in candidates:
+            if self.size <= target:
+                break
+            freed = node.collapse()
+            self.size -= freed
+            self.evicted_nodes += freed
+        if self.transpositions is not None:
+            # shared nodes may have been counted twice or still be linked
+            self.size = len(self.reachable())
+        self.evictions += 1
+
+    def memory_stats(self):
+        return {'nodes': self.size, 'evictions': self.evictions,
+                'evicted_nodes': self.evicted_nodes,
+                'reclaimed_nodes': self.reclaimed_nodes}
+
+    def expand(self, node):
+        created = node.expand(self.game, self.lazy_expansion, self.transpositions)
+        self.nodes += created
+        self.size += created
+        self.transposition_hits += len(node.children) - created
+
+    def root_child_stats(self):
+        return [(move, c.win_count, c.playout_count)
+                for c, move in zip(self.root.children, self.root.child_moves)]
+
+    def tree_stats(self):
+        """ Distinct nodes under the root against the child links to them;
+        a pure tree has one link less than nodes """
+        seen = {id(self.root)}
+        stack = [self.root]
+        links = 0
+        while stack:
+            node = stack.pop()
+            links += len(node.children)
+            for child in node.children:
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+        return {'positions': len(seen), 'links': links,
+                'transposition_hits': self.transposition_hits}
+
+    def choose_best_move(self):
+        self.search()
+        return self.best_move()
+
+    def best_move(self):
+        return self.root.get_best_move()
+
+    def search(self):
+        start = time.perf_counter()
+        self.playouts = 0
+        self.nodes = 0
+        self.stopped_early = False
+        while True:
+            remaining = self.remaining_playouts(start)
+            if remaining <= 0 and self.playouts:
+                break
+            size = int(min(self.batch_size, max(remaining, 1)))
+            if size > 1:
+                self.run_batch(size)
+            else:
+                self.run_playout()
+            self.playouts += size
+            if self.root.proven is not None:
+                self.stopped_early = True
+                break
+            if self.playouts // 16 != (self.playouts - size) // 16 and self.decided(remaining - size):
+                self.stopped_early = True
+                break
+
+    def remaining_playouts(self, start):
+        """ Playouts the budget has left, estimated from the rate so far """
+        remaining = math.inf
+        if self.number_of_playouts:
+            remaining = self.number_of_playouts - self.playouts
+        if self.time_limit is not None:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.time_limit:
+                return 0
+            if self.playouts:
+                rate = self.playouts / elapsed
+                remaining = min(remaining, rate * (self.time_limit - elapsed))
+        if self.node_limit is not None:
+            if self.nodes >= self.node_limit:
+                return 0
+            if self.nodes:
+                per_playout = self.nodes / self.playouts
+                remaining = min(remaining, (self.node_limit - self.nodes) / per_playout)
+        return remaining
+
+    def decided(self, remaining):
+        """ True if no root child can pass the best one by get_weight
+
+        The best child is assumed to lose every remaining playout while
+        each rival wins all of them.
+        """
+        if remaining == math.inf:
+            return False
+        children = self.root.children
+        if len(children) < 2:
+            return True
+        best = max(children, key=lambda c: c.get_weight())
+        floor = best.win_count / (best.playout_count + remaining)
+        return all(
+            (c.win_count + remaining * self.game.max_score) / (c.playout_count + remaining) < floor
+            for c in children if c is not best
+        )
+
+    def run_playout(self):
+        node, path, status = self.select_leaf()
+        if status == Status.IN_PROGRESS:
+            result = self.playout_policy.playout(self.view(node))
+        else:
+            # a finished game needs no playout
+            result = status
+        self.finish_leaf(node, path, result)
+
+    def solve(self, path, result):
+        """ Proves the leaf ending path with result, then its ancestors by
+        minimax for as long as they are decided """
+        path[-1].prove(result, self.game.score)
+        for node in reversed(path[:-1]):
+            result = node.minimax_result(self.game.max_score)
+            if result is None:
+                break
+            node.prove(result, self.game.score)
+
+    def select_leaf(self, virtual_loss=0):
+        """ The select and expand steps of a playout; virtual_loss visits
+        stay on the path until finish_leaf. Returns the node to play out,
+        its path from the root and its status, which is the result
+        already if the game is over there """
+        self.enforce_budget()
+        path = []
+        node = self.select(path)
+        if self.game.status(self.materialize(node)) == Status.IN_PROGRESS:
+            self.expand(node)
+        child = self.random_child(node)
+        if child is not None:
+            node = child
+            path.append(node)
+        status = self.game.status(self.materialize(node))
+        if status != Status.IN_PROGRESS and self.solver:
+            self.solve(path, status)
+        if virtual_loss:
+            self.add_visits(path, virtual_loss)
+        return node, path, status
+
+    def finish_leaf(self, node, path, result, virtual_loss=0):
+        if virtual_loss:
+            self.add_visits(path, -virtual_loss)
+        self.backpropagate(node, result, path)
+
+    # node storage; ArrayMcTree overrides these for its index based nodes
+
+    def select(self, path):
+        return self.select_policy.select(self.root, path)
+
+    def materialize(self, node):
+        return node.materialize(self.game)
+
+    @staticmethod
+    def random_child(node):
+        return node.random_child() if node.children else None
+
+    @staticmethod
+    def add_visits(path, count):
+        for node in path:
+            node.playout_count += count
+
+    def backpropagate(self, node, result, path):
+        node.backpropagate(result, self.game.score, path)
+
+    @staticmethod
+    def view(node):
+        """ What playout policies are handed for node """
+        return node
+
+    def run_batch(self, size):
+        leaves = [self.select_leaf(virtual_loss=1) for _ in range(size)]
+        unfinished = [node for node, _, status in leaves if status == Status.IN_PROGRESS]
+        results = iter(self.playout_policy.playout_many([self.view(n) for n in unfinished])
+                       if unfinished else [])
+        for node, path, status in leaves:
+            result = next(results) if status == Status.IN_PROGRESS else status
+            self.finish_leaf(node, path, result, virtual_loss=1)
+
+
+def _root_parallel_worker(conn, tree_type, args, options, seed):
+    random.seed(seed)
+    mct = tree_type(*args, **options)
+    while True:
+        command, arg = conn.recv()
+        if command == 'apply':
+            mct.apply_move(arg)
+        elif command == 'search':
+            mct.search()
+            conn.send(mct.root_child_stats())
+        else:
+            break
+    conn.close()
+
+
+class RootParallelMcTree:
+    """ Root parallelism: independent trees searched side by side
+
+    One tree lives in this process and workers - 1 more in persistent
+    worker processes, each seeded differently. Every move is applied to
+    all of them, so tree reuse still works. After a search the root child
+    statistics of all trees are summed per move before the best is picked.
+    """
+
+    def __init__(self, game, select_policy, playout_policy, number_of_playouts,
+                 workers=2, tree_type=McTree, **options):
+        args = (game, select_policy, playout_policy, number_of_playouts)
+        self.mct = tree_type(*args, **options)
+        self.workers = []
+        for _ in range(workers - 1):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_root_parallel_worker,
+                args=(worker_conn, tree_type, args, options, random.getrandbits(64)),
+                daemon=True,
+            )
+            process.start()
+            worker_conn.close()
+            self.workers.append((process, conn))
+
+    @property
+    def root(self):
+        return self.mct.root
+
+    def apply_move(self, move):
+        for _, conn in self.workers:
+            conn.send(('apply', move))
+        self.mct.apply_move(move)
+
+    def root_stats(self):
+        stats = {}
+        for _, conn in self.workers:
+            conn.send(('search', None))
+        self.mct.search()
+        results = [self.mct.root_child_stats()]
+        results += [conn.recv() for _, conn in self.workers]
+        for children in results:
+            for move, win_count, playout_count in children:
+                total = stats.setdefault(move, [0, 0])
+                total[0] += win_count
+                total[1] += playout_count
+        return stats
+
+    def memory_stats(self):
+        return self.mct.memory_stats()
 
     def choose_best_move(self):
-        for i in range(self.number_of_playouts):
-            # select
-            promising_node = self.select_policy.select(self.root)
-            # expand
-            if self.game.status(promising_node.game_state) == Status.IN_PROGRESS:
-                promising_node.expand(self.game)
-            # simulate
-            node_to_explore = promising_node
-            if node_to_explore.children:
-                node_to_explore = node_to_explore.random_child()
-            result = self.playout_policy.playout(node_to_explore)
-            # update
-            node_to_explore.add_playout(result, self.game.score)
-        return self.root.get_best_child().move
+        stats = self.root_stats()
+        weights = {move: w / n if n else 0 for move, (w, n) in stats.items()}
+        best_weight = max(weights.values())
+        return choice([move for move, weight in weights.items()
+                       if weight == best_weight])
+
+    def close(self):
+        for process, conn in self.workers:
+            conn.send(('close', None))
+            conn.close()
+            process.join()
+        self.workers = []
+
+    def __del__(self):
+        self.close()
+
+
+_worker_playout_policy = None
+
+
+def _init_playout_worker(playout_policy):
+    global _worker_playout_policy
+    _worker_playout_policy = playout_policy
+
+
+def _worker_playout(game_state):
+    return _worker_playout_policy.playout(McTreeNode(game_state))
+
+
+class TreeParallelMcTree(McTree):
+    """ Tree parallelism: one tree here, playouts in worker processes
+
+    This process selects, expands and backpropagates; up to workers
+    playouts run at once. Each pending playout adds virtual_loss lost
+    visits along its path, so the next selections spread to other leaves.
+    The playout policy sees a detached node holding only the game state.
+    """
+
+    def __init__(self, game, select_policy, playout_policy, number_of_playouts,
+                 workers=2, virtual_loss=1, **options):
+        super().__init__(game, select_policy, playout_policy, number_of_playouts,
+                         **options)
+        self.workers = workers
+        self.virtual_loss = virtual_loss
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_playout_worker, initargs=(playout_policy,)
+        )
+
+    def start_playout(self):
+        node, path, status = self.select_leaf(self.virtual_loss)
+        if status == Status.IN_PROGRESS:
+            future = self.pool.submit(_worker_playout, node.game_state)
+        else:
+            # a finished game needs no worker
+            future = concurrent.futures.Future()
+            future.set_result(status)
+        return future, node, path
+
+    def finish_playout(self, node, path, result):
+        self.finish_leaf(node, path, result, self.virtual_loss)
+
+    def search(self):
+        """ Runs to the budget or until the root is proven; virtual visits
+        would skew decided(), so there is no other early stop here """
+        start = time.perf_counter()
+        self.playouts = 0
+        self.nodes = 0
+        pending = {}
+        while True:
+            remaining = self.remaining_playouts(start) - len(pending)
+            if self.root.proven is not None:
+                remaining = 0
+            while len(pending) < self.workers and (remaining > 0 or not pending and not self.playouts):
+                future, node, path = self.start_playout()
+                pending[future] = (node, path)
+                remaining -= 1
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                node, path = pending.pop(future)
+                self.finish_playout(node, path, future.result())
+                self.playouts += 1
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __del__(self):
+        self.close()
@@ -1,4 +1,5 @@
 import os
+import concurrent.futures
 from chess_ai import Status
 from chess_ai import ChessMctsPlayer
 from chess_ai import ChessAlphBetaPlayer
@@ -35,18 +36,26 @@ def self_play(player1: AiPlayer, player2: AiPlayer, show=False):
     return player1.status()
 
 
-def play(name, white, black, times=1, show=False):
+def play(name, white, black, times=1, show=False, workers=1):
+    """ Plays times games; with workers > 1 the games run in parallel threads,
+    so their searches can evaluate leaves on a StockfishPool concurrently """
     scores = {'white': 0, 'black': 0, 'draw': 0}
     print(name)
-    for _ in range(times):
+
+    def play_one(_):
         try:
-            result = self_play(white, black, show=show)
+            return self_play(white, black, show=show)
+        except Exception as e:
+            print(e)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for result in executor.map(play_one, range(times)):
+            if result is None:
+                continue
             if result == Status.DRAW:
                 scores['draw'] += 1
             elif result == Status.WHITE_WIN:
                 scores['white'] += 1
             else:
                 scores['black'] += 1
-        except Exception as e:
-            print(e)
     print(scores)
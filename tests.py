@@ -1,17 +1,143 @@
-import os
 from self_play import play
 from chess_ai import ChessMctsPlayer
 from chess_ai import ChessAlphBetaPlayer
 from chess_ai import ChessRandomPlayer
 from chess_ai import score_board_stockfish, score_board_with_pos_bias
-from chess_ai import load_stockfish
+from chess_ai import load_stockfish, close_stockfish
 from chess_ai import UniformRandomPlayoutPolicy
+from chess_ai import IncrementalEvalBoard, score_board_incremental
+from chess_ai import score_board_bitboard
+from chess_ai import EvalCache
+from chess_ai import Game
+from xo import XoGame, XoUniformRandomPlayoutPolicy
+from array_mcts import ArrayMcTree
+import batch_chess
+import generic_mcts
+import chess
+import numpy as np
+from random import choice, seed
 
 
-try:
-    global stockfish
-    load_stockfish()
+def test_incremental_eval(games=200, max_plies=300):
+    seen = {'capture': 0, 'castling': 0, 'en passant': 0, 'promotion': 0}
+    # seeded so every kind of move is sure to come up
+    seed(0)
+    for _ in range(games):
+        board = IncrementalEvalBoard()
+        for _ in range(max_plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = choice(moves)
+            seen['capture'] += board.is_capture(move)
+            seen['castling'] += board.is_castling(move)
+            seen['en passant'] += board.is_en_passant(move)
+            seen['promotion'] += move.promotion is not None
+            board.push(move)
+            assert score_board_incremental(board) == score_board_with_pos_bias(board), board.fen()
+            assert score_board_bitboard(board) == score_board_with_pos_bias(board), board.fen()
+            copy = board.copy(stack=False)
+            assert copy.pos_bias_score == board.pos_bias_score
+        while board.move_stack:
+            board.pop()
+            assert score_board_incremental(board) == score_board_with_pos_bias(board), board.fen()
+    seed()
+    assert all(seen.values()), seen
+    print("incremental eval matches score_board_with_pos_bias", seen)
+
+
+test_incremental_eval()
+
+
+def batch_chess_board(squares, turn):
+    board = chess.Board(None)
+    for square in np.flatnonzero(squares):
+        piece = int(squares[square])
+        board.set_piece_at(int(square), chess.Piece(piece >> 1, not piece & 1))
+    board.turn = not turn
+    return board
+
+
+def test_batch_chess(games=200, max_plies=120, playouts=1000):
+    boards = []
+    for _ in range(games):
+        board = chess.Board()
+        for _ in range(max_plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(choice(moves))
+            boards.append(board.copy(stack=False))
+    squares, turn, _ = batch_chess.from_boards(boards)
+    slots, moves = batch_chess.pseudo_legal(squares, batch_chess.occupancy(squares), turn)
+    rows, columns = np.nonzero(moves)
+    illegal = batch_chess.leaves_check(squares[rows], turn[rows], slots[rows, columns])
+    legal = [set() for _ in boards]
+    for row, slot in zip(rows[~illegal], slots[rows[~illegal], columns[~illegal]]):
+        legal[row].add((int(batch_chess.FROM[slot]), int(batch_chess.TO[slot])))
+    checks = 0
+    for board, found in zip(boards, legal):
+        # the simplified rules: no castling, no en passant, queen promotions
+        expected = {(m.from_square, m.to_square) for m in board.legal_moves
+                    if not board.is_castling(m) and not board.is_en_passant(m)
+                    and m.promotion in (None, chess.QUEEN)}
+        assert found == expected, board.fen()
+        checks += board.is_check()
+    assert checks, "no position in check"
+
+    squares, turn, halfmove = batch_chess.from_boards([chess.Board()] * playouts)
+    results, _ = batch_chess.random_playouts(squares, turn, halfmove, 400)
+    for result, board_squares, board_turn, clock in zip(results, squares, turn, halfmove):
+        board = batch_chess_board(board_squares, board_turn)
+        if result in (batch_chess.WHITE, batch_chess.BLACK):
+            assert board.is_checkmate() and result == 1 - board_turn, board.fen()
+        elif result == batch_chess.DRAW:
+            assert (board.is_stalemate() or board.is_insufficient_material()
+                    or clock >= 150), board.fen()
+    print("batch_chess matches python-chess on", len(boards), "positions,",
+          "results", np.bincount(results, minlength=4).tolist())
+
+
+test_batch_chess()
+
 
+class RecursiveBackpropMcTree(generic_mcts.McTree):
+    def backpropagate(self, node, result, path):
+        node.add_playout(result, self.game.score)
+
+
+def tree_stats(node):
+    stats = [(node.playout_count, node.win_count)]
+    for child in node.children:
+        stats += tree_stats(child)
+    return stats
+
+
+def test_iterative_backprop():
+    cases = [
+        (XoGame, XoUniformRandomPlayoutPolicy(), 3000),
+        (Game, UniformRandomPlayoutPolicy(max_playout_len=100), 200),
+    ]
+    for game, playout_policy, playouts in cases:
+        stats = []
+        for tree_type in (RecursiveBackpropMcTree, generic_mcts.McTree, ArrayMcTree):
+            seed(0)
+            mct = tree_type(game, generic_mcts.UctSelectPolicy(),
+                            playout_policy, playouts)
+            mct.choose_best_move()
+            stats.append(tree_stats(mct.root))
+        assert stats[0] == stats[1] == stats[2]
+    seed()
+    print("iterative backpropagation matches add_playout")
+
+
+test_iterative_backprop()
+
+
+load_stockfish()
+stockfish_cache = EvalCache(score_board_stockfish, path='eval_cache.sqlite')
+
+try:
     play(
         "alpha beta (white), 1, score_board_with_pos_bias",
         white=lambda: ChessAlphBetaPlayer(
@@ -82,7 +208,7 @@ try:
         "alpha beta (white), 1, score_board_stockfish",
         white=lambda: ChessAlphBetaPlayer(
             search_depth=1,
-            heuristic=score_board_stockfish,
+            heuristic=stockfish_cache,
         ),
         black=lambda: ChessRandomPlayer(),
         times=5,
@@ -94,7 +220,7 @@ try:
         white=lambda: ChessRandomPlayer(),
         black=lambda: ChessAlphBetaPlayer(
             search_depth=1,
-            heuristic=score_board_stockfish,
+            heuristic=stockfish_cache,
         ),
         times=5,
         show=False,
@@ -104,7 +230,7 @@ try:
         "alpha beta (white), 2, score_board_stockfish",
         white=lambda: ChessAlphBetaPlayer(
             search_depth=2,
-            heuristic=score_board_stockfish,
+            heuristic=stockfish_cache,
         ),
         black=lambda: ChessRandomPlayer(),
         times=5,
@@ -116,7 +242,7 @@ try:
         white=lambda: ChessRandomPlayer(),
         black=lambda: ChessAlphBetaPlayer(
             search_depth=2,
-            heuristic=score_board_stockfish,
+            heuristic=stockfish_cache,
         ),
         times=5,
         show=False,
@@ -146,4 +272,6 @@ try:
     )
 
 finally:
-    os._exit(0)
+    stockfish_cache.close()
+    print("stockfish eval cache", stockfish_cache.stats())
+    close_stockfish()
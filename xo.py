@@ -30,6 +30,9 @@ class XoMove(generic_mcts.Move):
             self.player == other.player
         )
 
+    def __hash__(self):
+        return hash((self.r, self.c, self.player))
+
 
 class XoGameState(generic_mcts.GameState):
     def __init__(self, board, player):
@@ -115,6 +118,14 @@ class XoGame(generic_mcts.Game):
         ]
         return moves
 
+    @staticmethod
+    def hash_state(game_state):
+        h = 0
+        for row in game_state.board:
+            for player in row:
+                h = 3 * h + ' xo'.index(player)
+        return 2 * h + (game_state.player == 'x')
+
     @staticmethod
     def initial_state():
         board = [